@@ -0,0 +1,380 @@
+# bench/run.py
+import argparse
+import gzip
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from sqlalchemy import create_engine
+REPO_ROOT = Path(__file__).resolve().parent.parent
+ALLOWED_TEAMS = ["Aortic", "CAS", "CRDN", "ECT", "PVH", "SVT", "TCT", "CPT", "DS", "PCS & CDS", "PM", "MCS"]
+SECTIONS = [
+    "Reportability", "Regulatory Report", "Regulatory Inquiry", "Product Analysis",
+    "Investigation", "Communication", "Task", "E-mail", "Complaint Wizard",
+]
+HEARTBEAT_MS = 60 * 1000
+READ_ENDPOINTS = ["/sessions", "/sessions_by_section", "/sections_by_weekday", "/events"]
+INGEST_FORMATS = ["json", "bulk"]
+BULK_REASON_CODES = {
+    "open": "o", "heartbeat": "h", "unload": "u", "visibility": "v", "section_change": "s", "complaint_change": "c",
+}
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+def _pct(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    v = sorted(values)
+    return round(v[min(len(v) - 1, int(round(q * (len(v) - 1))))], 3)
+def _summary(latencies_ms: list[float], errors: int, elapsed_s: float) -> dict:
+    return {
+        "requests": len(latencies_ms),
+        "errors": errors,
+        "rps": round(len(latencies_ms) / elapsed_s, 1) if elapsed_s else None,
+        "p50_ms": _pct(latencies_ms, 0.50),
+        "p99_ms": _pct(latencies_ms, 0.99),
+        "max_ms": round(max(latencies_ms), 3) if latencies_ms else None,
+    }
+def _git_sha() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+def _complaint_id(rng: random.Random) -> str:
+    return rng.choice("67") + "".join(rng.choice(string.digits) for _ in range(rng.randint(5, 11)))
+def simulated_user(rng: random.Random, start: datetime):
+    email = f"user{rng.randrange(10**6)}@medtronic.com"
+    team = rng.choice(ALLOWED_TEAMS)
+    while True:
+        session_id = "".join(rng.choice(string.ascii_lowercase + string.digits) for _ in range(11))
+        source = "CW" if rng.random() < 0.15 else "GCH"
+        complaint_id = _complaint_id(rng)
+        section = "Complaint Wizard" if source == "CW" else rng.choice(SECTIONS[:-1])
+        page = f"https://crm.medtronic.com/sap/bc/bsp/sap/crm_ui_start/default.htm?OBJECT_ID={complaint_id}"
+        ts = start
+        def event(reason: str, active_ms: int, idle_ms: int) -> dict:
+            return {
+                "ts": ts.isoformat().replace("+00:00", "Z"),
+                "email": email,
+                "team": team,
+                "complaint_id": complaint_id,
+                "source": source,
+                "section": section,
+                "reason": reason,
+                "active_ms": active_ms,
+                "idle_ms": idle_ms,
+                "page": page,
+                "session_id": session_id,
+                "event_id": "%032x" % rng.getrandbits(128),
+            }
+        yield event("open", 0, 0)
+        for _ in range(rng.randint(3, 30)):
+            ts += timedelta(milliseconds=HEARTBEAT_MS)
+            active = rng.randint(0, HEARTBEAT_MS)
+            idle = rng.randint(0, HEARTBEAT_MS - active) if rng.random() < 0.3 else 0
+            if source == "GCH" and rng.random() < 0.1:
+                yield event("section_change", active, idle)
+                section = rng.choice(SECTIONS[:-1])
+                continue
+            yield event("heartbeat", active, idle)
+        ts += timedelta(milliseconds=rng.randint(1000, HEARTBEAT_MS))
+        yield event("unload", rng.randint(0, 30000), 0)
+        start = ts + timedelta(minutes=rng.randint(1, 20))
+def encode_bulk(events: list[dict]) -> bytes:
+    lines, last = [], {}
+    for ev in events:
+        ctx = {"s": ev["session_id"], "e": ev["email"], "t": ev["team"], "o": ev["source"],
+               "c": ev["complaint_id"], "x": ev["section"], "p": ev["page"]}
+        diff = {k: v for k, v in ctx.items() if last.get(k) != v}
+        if diff:
+            lines.append(json.dumps(diff, separators=(",", ":")))
+        last = ctx
+        ts_ms = int(datetime.fromisoformat(ev["ts"]).timestamp() * 1000)
+        lines.append(json.dumps([ts_ms, BULK_REASON_CODES.get(ev["reason"], ev["reason"]),
+                                 ev["active_ms"], ev["idle_ms"], ev["event_id"]], separators=(",", ":")))
+    return gzip.compress(("\n".join(lines) + "\n").encode("utf-8"))
+def _cpu_seconds(pid: int) -> float | None:
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+class Server:
+    def __init__(self, env: dict, log_path: Path):
+        self.port = _free_port()
+        self.log = open(log_path, "w")
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server.main:app",
+             "--host", "127.0.0.1", "--port", str(self.port), "--log-level", "warning"],
+            cwd=REPO_ROOT, env={**os.environ, **env}, stdout=self.log, stderr=subprocess.STDOUT,
+        )
+    def wait_ready(self, timeout: float = 60.0) -> float:
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < timeout:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"server exited with {self.proc.returncode}; see {self.log.name}")
+            try:
+                status, _ = request(http.client.HTTPConnection("127.0.0.1", self.port, timeout=5), "GET", "/health")
+                if status == 200:
+                    return time.perf_counter() - t0
+            except OSError:
+                pass
+            time.sleep(0.05)
+        raise RuntimeError("server did not become ready")
+    def stop(self) -> None:
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+        self.log.close()
+def request(conn: http.client.HTTPConnection, method: str, path: str, body: bytes | None = None,
+            headers: dict | None = None) -> tuple[int, bytes]:
+    conn.request(method, path, body=body, headers=headers or {})
+    resp = conn.getresponse()
+    return resp.status, resp.read()
+def run_ingest(port: int, users: int, duration: float, seed: int, fmt: str = "json", batch: int = 5,
+               server_pid: int | None = None) -> dict:
+    latencies: list[float] = []
+    errors = [0]
+    sent = [0, 0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+    def worker(i: int) -> None:
+        rng = random.Random(seed + i)
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        gen = simulated_user(rng, datetime.now(timezone.utc) - timedelta(days=rng.randint(0, 6)))
+        local, errs, events, nbytes = [], 0, 0, 0
+        while time.perf_counter() < stop_at:
+            if fmt == "bulk":
+                chunk = [next(gen) for _ in range(batch)]
+                path, body, headers = "/ingest_bulk", encode_bulk(chunk), {"Content-Type": "application/x-ndjson"}
+            else:
+                chunk = [next(gen)]
+                path = "/ingest"
+                body = json.dumps(chunk[0], separators=(",", ":")).encode("utf-8")
+                headers = {"Content-Type": "application/json"}
+            t0 = time.perf_counter()
+            try:
+                status, _ = request(conn, "POST", path, body, headers)
+            except OSError:
+                status = 0
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            local.append((time.perf_counter() - t0) * 1000)
+            if status != 200:
+                errs += 1
+            else:
+                events += len(chunk)
+                nbytes += len(body)
+        with lock:
+            latencies.extend(local)
+            errors[0] += errs
+            sent[0] += events
+            sent[1] += nbytes
+    cpu0 = _cpu_seconds(server_pid) if server_pid else None
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    cpu1 = _cpu_seconds(server_pid) if server_pid else None
+    events, nbytes = sent
+    return {
+        "format": fmt,
+        **_summary(latencies, errors[0], elapsed),
+        "events": events,
+        "events_per_s": round(events / elapsed, 1) if elapsed else None,
+        "bytes_per_event": round(nbytes / events, 1) if events else None,
+        "server_cpu_ms_per_event": (
+            round((cpu1 - cpu0) * 1000 / events, 3) if events and cpu0 is not None and cpu1 is not None else None
+        ),
+    }
+def run_reads(port: int, readers: int, duration: float, complaint_id: str) -> dict:
+    latencies: dict[str, list[float]] = {p: [] for p in READ_ENDPOINTS}
+    errors = {p: 0 for p in READ_ENDPOINTS}
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+    def worker(i: int) -> None:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        n = i
+        while time.perf_counter() < stop_at:
+            endpoint = READ_ENDPOINTS[n % len(READ_ENDPOINTS)]
+            n += 1
+            path = f"/events?complaint_id={complaint_id}" if endpoint == "/events" else endpoint
+            t0 = time.perf_counter()
+            try:
+                status, _ = request(conn, "GET", path)
+            except OSError:
+                status = 0
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+            elapsed = (time.perf_counter() - t0) * 1000
+            with lock:
+                latencies[endpoint].append(elapsed)
+                if status != 200:
+                    errors[endpoint] += 1
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    return {p: _summary(latencies[p], errors[p], elapsed) for p in READ_ENDPOINTS}
+def seed_events(db_url: str, env: dict, target_rows: int, seed: int) -> int:
+    eng = create_engine(db_url)
+    with eng.begin() as conn:
+        have = conn.exec_driver_sql("SELECT COUNT(*) FROM events").scalar() or 0
+    eng.dispose()
+    if have < target_rows:
+        subprocess.run(
+            [sys.executable, "-m", "server.seed", "--rows", str(target_rows - have),
+             "--seed", str(seed + have), "--days", "7", "--quiet"],
+            cwd=REPO_ROOT, env={**os.environ, **env}, check=True,
+        )
+    return max(have, target_rows)
+def time_export(port: int) -> dict:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=3600)
+    t0 = time.perf_counter()
+    try:
+        status, body = request(conn, "GET", "/export.xlsx")
+    except OSError as e:
+        return {"status": 0, "error": str(e), "seconds": round(time.perf_counter() - t0, 3)}
+    out = {"status": status, "seconds": round(time.perf_counter() - t0, 3), "bytes": len(body)}
+    if status != 200:
+        out["error"] = body[:500].decode("utf-8", "replace")
+    return out
+def _start_postgres(workdir: Path) -> tuple[str, subprocess.Popen] | None:
+    initdb, postgres = shutil.which("initdb"), shutil.which("postgres")
+    if not (initdb and postgres):
+        return None
+    data = workdir / "pgdata"
+    subprocess.run([initdb, "-D", str(data), "-U", "bench", "--auth=trust"],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    port = _free_port()
+    proc = subprocess.Popen(
+        [postgres, "-D", str(data), "-p", str(port), "-k", str(workdir), "-c", "listen_addresses=127.0.0.1"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"postgresql+psycopg://bench@127.0.0.1:{port}/postgres"
+    for _ in range(100):
+        try:
+            create_engine(url).connect().close()
+            return url, proc
+        except Exception:
+            time.sleep(0.1)
+    proc.terminate()
+    return None
+def bench_backend(name: str, env: dict, db_url: str, args, workdir: Path) -> dict:
+    result = {"backend": name}
+    server = Server(env, workdir / f"{name}-server.log")
+    try:
+        result["startup_s"] = round(server.wait_ready(), 3)
+        result["ingest"], result["ingest_with_readers"], result["reads_during_ingest"] = {}, {}, {}
+        for k, fmt in enumerate(args.ingest_formats):
+            print(f"[bench] {name}: {fmt} ingest {args.users} users for {args.duration}s, no readers")
+            result["ingest"][fmt] = run_ingest(server.port, args.users, args.duration, args.seed + 2000 * k, fmt,
+                                               args.batch, server.proc.pid)
+            if not args.readers:
+                continue
+            print(f"[bench] {name}: {fmt} ingest {args.users} users for {args.duration}s with {args.readers} readers")
+            reads = {}
+            reader = threading.Thread(target=lambda: reads.update(
+                run_reads(server.port, args.readers, args.duration, "612345")
+            ))
+            reader.start()
+            result["ingest_with_readers"][fmt] = run_ingest(server.port, args.users, args.duration,
+                                                            args.seed + 2000 * k + 1000, fmt, args.batch)
+            reader.join()
+            result["reads_during_ingest"][fmt] = reads
+        result["export"] = {}
+        for n in args.rows:
+            print(f"[bench] {name}: seeding to {n} rows")
+            have = seed_events(db_url, env, n, args.seed)
+            print(f"[bench] {name}: export at {have} rows")
+            result["export"][str(n)] = {"rows": have, **time_export(server.port)}
+            result["export"][str(n)]["reads"] = run_reads(server.port, 1, args.read_duration, "612345")
+    finally:
+        server.stop()
+    return result
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Load-test server.main:app with synthetic extension and dashboard traffic.")
+    ap.add_argument("--users", type=int, default=20, help="simulated extension users (concurrent ingest clients)")
+    ap.add_argument("--readers", type=int, default=2, help="concurrent dashboard readers during ingest")
+    ap.add_argument("--duration", type=float, default=15.0, help="seconds of each ingest pass (alone, then with readers)")
+    ap.add_argument("--read-duration", type=float, default=5.0, help="seconds of read traffic at each row count")
+    ap.add_argument("--rows", default="10000", help="comma-separated row counts for export timing, e.g. 10000,1000000,10000000")
+    ap.add_argument("--backends", default="sqlite,postgres", help="comma-separated: sqlite, postgres")
+    ap.add_argument("--pg-url", default=os.getenv("BENCH_DATABASE_URL", ""), help="Postgres URL; a temporary cluster is started if omitted and initdb is available")
+    ap.add_argument("--ingest-formats", default="json,bulk", help="comma-separated: json (/ingest), bulk (/ingest_bulk)")
+    ap.add_argument("--batch", type=int, default=5, help="events per /ingest_bulk request")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", default=str(REPO_ROOT / "bench" / "results"))
+    args = ap.parse_args(argv)
+    args.rows = [int(r) for r in args.rows.split(",") if r.strip()]
+    args.ingest_formats = [f.strip() for f in args.ingest_formats.split(",") if f.strip() in INGEST_FORMATS]
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    report = {
+        "commit": _git_sha(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "pg_url")},
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="gch-bench-") as tmp:
+        workdir = Path(tmp)
+        base_env = {
+            "SUBSCRIBERS_CSV_PATH": str(workdir / "subscribers.csv"),
+            "SLOW_QUERY_MS": "0",
+            "SENDGRID_API_KEY": "",
+        }
+        if "sqlite" in backends:
+            db_path = workdir / "events.db"
+            env = {**base_env, "DB_PATH": str(db_path), "DATABASE_URL": ""}
+            report["results"]["sqlite"] = bench_backend("sqlite", env, f"sqlite:///{db_path}", args, workdir)
+        if "postgres" in backends:
+            pg_proc = None
+            pg_url = args.pg_url
+            if not pg_url:
+                started = _start_postgres(workdir)
+                if started:
+                    pg_url, pg_proc = started
+            if not pg_url:
+                report["results"]["postgres"] = {"skipped": "no --pg-url and no local initdb/postgres"}
+                print("[bench] postgres: skipped (no --pg-url and no local initdb/postgres)")
+            else:
+                try:
+                    env = {**base_env, "DATABASE_URL": pg_url}
+                    db_url = pg_url.replace("postgres://", "postgresql+psycopg://", 1)
+                    if db_url.startswith("postgresql://"):
+                        db_url = db_url.replace("postgresql://", "postgresql+psycopg://", 1)
+                    report["results"]["postgres"] = bench_backend("postgres", env, db_url, args, workdir)
+                finally:
+                    if pg_proc:
+                        pg_proc.terminate()
+                        pg_proc.wait(timeout=30)
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    out_path = out_dir / f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}-{report['commit']}.json"
+    out_path.write_text(json.dumps(report, indent=2))
+    print(json.dumps(report["results"], indent=2))
+    print(f"[bench] wrote {out_path}")
+    return 0
+if __name__ == "__main__":
+    sys.exit(main())
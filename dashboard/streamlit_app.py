@@ -3,11 +3,17 @@ import pandas as pd
 import streamlit as st
 import altair as alt
 from datetime import timedelta
+from pathlib import Path
 import io
+import json
 import re
+import sqlite3
+import threading
+import time
 API_BASE = st.secrets.get("API_BASE", "https://gch-timer-api.onrender.com")
 TIMEOUT = 30
 TZ_NAME = "America/Chicago"
+SUBSCRIBE_TEAMS = ["Aortic","CAS","CRDN","ECT","PVH","SVT","TCT","CPT","DS","PCS & CDS","PM","MCS"]
 st.set_page_config(page_title="GCH/CW Timer", layout="wide")
 st.title("GCH/CW Timer")
 def fmt_hms_from_ms(ms: int | float) -> str:
@@ -20,21 +26,178 @@ def to_weekday(dt: pd.Timestamp) -> str:
     if pd.isna(dt):
         return ""
     return dt.day_name()
-@st.cache_data(ttl=60)
-def fetch_sessions() -> pd.DataFrame:
-    schema = [
-        "session_id", "email", "team", "complaint_id", "source", "start_ts", "active_ms", "idle_ms",
-        "Active HH:MM:SS", "Idle HH:MM:SS", "Start", "Active Minutes", "Idle Minutes", "Weekday"
+SESSION_SCHEMA = [
+    "session_id", "email", "team", "complaint_id", "source", "start_ts", "active_ms", "idle_ms",
+    "Active HH:MM:SS", "Idle HH:MM:SS", "Start", "Active Minutes", "Idle Minutes", "Weekday"
+]
+MIRROR_COLUMNS = [
+    "seq", "ts", "email", "team", "complaint_id", "source", "section",
+    "reason", "active_ms", "idle_ms", "page", "session_id",
+]
+MIRROR_PATH = st.secrets.get("DASHBOARD_CACHE_PATH", str(Path(__file__).with_name("events_cache.db")))
+SYNC_PAGE_ROWS = 20000
+LIVE_POLL_S = 5
+SNAPSHOT_TTL_S = 60
+SESSIONS_SQL = """
+  SELECT
+    session_id, email, team, complaint_id, source,
+    MIN(ts) AS start_ts,
+    COALESCE(SUM(active_ms),0) AS active_ms,
+    COALESCE(SUM(idle_ms),0)   AS idle_ms
+  FROM events
+  GROUP BY session_id, email, team, complaint_id, source
+  HAVING (COALESCE(SUM(active_ms),0) + COALESCE(SUM(idle_ms),0)) >= 1000
+  ORDER BY MAX(ts) DESC
+"""
+BY_SECTION_SQL = """
+  SELECT email, team, complaint_id, source, section,
+    COALESCE(SUM(active_ms),0) AS active_ms
+  FROM daily
+  WHERE section <> ''
+  GROUP BY email, team, complaint_id, source, section
+  ORDER BY MAX(last_ts) DESC
+"""
+DAILY_UPSERT_SQL = """
+  INSERT INTO daily (day, team, email, complaint_id, source, section, active_ms, idle_ms, last_ts)
+  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+  ON CONFLICT (day, team, email, complaint_id, source, section) DO UPDATE SET
+    active_ms = daily.active_ms + excluded.active_ms,
+    idle_ms   = daily.idle_ms + excluded.idle_ms,
+    last_ts   = MAX(COALESCE(daily.last_ts, ''), COALESCE(excluded.last_ts, ''))
+"""
+def _daily_rows(rows: list[dict]) -> list[tuple]:
+    t = pd.to_datetime(pd.Series([r.get("ts") for r in rows], dtype="object"), errors="coerce", utc=True)
+    days = t.dt.tz_convert(TZ_NAME).dt.strftime("%Y-%m-%d").fillna("")
+    return [
+        (day, (r.get("team") or "").strip(), r.get("email") or "",
+         r.get("complaint_id") or "", r.get("source") or "", (r.get("section") or "").strip(),
+         int(r.get("active_ms") or 0), int(r.get("idle_ms") or 0), r.get("ts"))
+        for day, r in zip(days, rows)
     ]
+class Mirror:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.last_pull = 0.0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"CREATE TABLE IF NOT EXISTS events (seq INTEGER PRIMARY KEY, {', '.join(MIRROR_COLUMNS[1:])})")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_events_complaint ON events (complaint_id, ts)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'daily'").fetchone():
+                conn.execute(
+                    "CREATE TABLE daily (day, team, email, complaint_id, source, section, active_ms, idle_ms, last_ts, "
+                    "PRIMARY KEY (day, team, email, complaint_id, source, section))"
+                )
+                cur = conn.execute(f"SELECT {', '.join(MIRROR_COLUMNS)} FROM events")
+                while batch := cur.fetchmany(SYNC_PAGE_ROWS):
+                    conn.executemany(DAILY_UPSERT_SQL, _daily_rows([dict(zip(MIRROR_COLUMNS, r)) for r in batch]))
+        self.version = self._meta("version", "0")
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+    def _meta(self, key: str, default: str = "") -> str:
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+    def cursor(self) -> str:
+        return self._meta("cursor")
+    def apply(self, rows: list[dict], cursor: str, reset: bool = False) -> None:
+        with self.lock, self._connect() as conn:
+            if reset:
+                conn.execute("DELETE FROM events")
+                conn.execute("DELETE FROM daily")
+            if rows:
+                seqs = [r.get("seq") for r in rows]
+                have = {s for (s,) in conn.execute(
+                    "SELECT seq FROM events WHERE seq BETWEEN ? AND ?", (min(seqs), max(seqs))
+                )}
+                rows = [r for r in rows if r.get("seq") not in have]
+                conn.executemany(
+                    f"INSERT INTO events ({', '.join(MIRROR_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(MIRROR_COLUMNS))})",
+                    [tuple(r.get(c) for c in MIRROR_COLUMNS) for r in rows],
+                )
+                conn.executemany(DAILY_UPSERT_SQL, _daily_rows(rows))
+            version = str(int(self.version) + 1) if (rows or reset) else self.version
+            conn.executemany(
+                "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                [("cursor", cursor), ("version", version)],
+            )
+        self.version = version
+    def pull(self, full: bool = False) -> None:
+        since = "" if full else self.cursor()
+        while True:
+            r = requests.get(f"{API_BASE}/events_since",
+                             params={"since": since, "limit": SYNC_PAGE_ROWS}, timeout=TIMEOUT)
+            r.raise_for_status()
+            page = r.json()
+            self.apply(page["rows"], page["cursor"], reset=page["reset"])
+            since = page["cursor"]
+            if not page["more"]:
+                break
+        self.last_pull = time.time()
+    def read_sql(self, sql: str, params: tuple = ()) -> pd.DataFrame:
+        with self._connect() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+class LiveFeed:
+    def __init__(self, mirror: Mirror):
+        self.mirror = mirror
+        self.thread = None
+    def start(self) -> None:
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name="gch-live-feed", daemon=True)
+            self.thread.start()
+    def _run(self) -> None:
+        backoff = 1
+        while True:
+            try:
+                with requests.get(f"{API_BASE}/stream", params={"since": self.mirror.cursor()},
+                                  stream=True, timeout=(TIMEOUT, 60)) as r:
+                    r.raise_for_status()
+                    backoff = 1
+                    event, data, cursor = "", "", ""
+                    for line in r.iter_lines(decode_unicode=True):
+                        if line is None:
+                            continue
+                        if line.startswith("event:"):
+                            event = line[6:].strip()
+                        elif line.startswith("data:"):
+                            data += line[5:].strip()
+                        elif line.startswith("id:"):
+                            cursor = line[3:].strip()
+                        elif line == "":
+                            if event == "delta" and data:
+                                self.mirror.apply(json.loads(data).get("rows", []), cursor)
+                            elif event == "hello" and not self.mirror.cursor():
+                                self.mirror.pull()
+                            elif event == "reset":
+                                epoch = json.loads(data or "{}").get("cursor", "").partition(":")[0]
+                                self.mirror.apply([], f"{epoch}:0", reset=True)
+                            event, data = "", ""
+            except Exception:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+@st.cache_resource
+def mirror() -> Mirror:
+    return Mirror(MIRROR_PATH)
+@st.cache_resource
+def live_feed() -> LiveFeed:
+    return LiveFeed(mirror())
+def sync_data(live: bool, force: bool = False) -> None:
+    m = mirror()
     try:
-        r = requests.get(f"{API_BASE}/sessions", timeout=TIMEOUT)
-        if r.status_code != 200:
-            st.error(f"/sessions failed: {r.status_code} {r.text}")
-            return pd.DataFrame(columns=schema)
-        df = pd.DataFrame(r.json())
+        if force or not m.cursor() or (not live and time.time() - m.last_pull >= SNAPSHOT_TTL_S):
+            m.pull(full=force)
     except Exception as e:
-        st.error(f"/sessions failed: {e}")
-        return pd.DataFrame(columns=schema)
+        st.error(f"/events_since failed: {e}")
+    if live:
+        live_feed().start()
+@st.cache_data(max_entries=32, show_spinner=False)
+def _mirror_query(sql: str, params: tuple, version: str) -> pd.DataFrame:
+    return mirror().read_sql(sql, params)
+def fetch_sessions() -> pd.DataFrame:
+    schema = SESSION_SCHEMA
+    df = _mirror_query(SESSIONS_SQL, (), mirror().version)
     if df.empty:
         return pd.DataFrame(columns=schema)
     for col in ("active_ms", "idle_ms"):
@@ -173,24 +336,23 @@ def build_excel_bytes(sessions_df: pd.DataFrame,
             timeline_df.to_excel(w, index=False, sheet_name="Activity_Timeline")
     buf.seek(0)
     return buf.read()
-@st.cache_data(ttl=60)
 def fetch_by_section() -> pd.DataFrame:
-    r = requests.get(f"{API_BASE}/sessions_by_section", timeout=TIMEOUT)
-    if r.status_code != 200:
-        return pd.DataFrame(columns=["email","team","complaint_id","section","active_ms","Minutes"])
-    df = pd.DataFrame(r.json())
+    df = _mirror_query(BY_SECTION_SQL, (), mirror().version)
     if df.empty:
         return pd.DataFrame(columns=["email","team","complaint_id","section","active_ms","Minutes"])
     df["active_ms"] = pd.to_numeric(df["active_ms"], errors="coerce").fillna(0).astype(int)
     df["Minutes"] = (df["active_ms"]/60000.0)
     df["HH:MM:SS"] = df["active_ms"].apply(fmt_hms_from_ms)
     return df[["email","team","complaint_id","section","active_ms","Minutes","HH:MM:SS"]]
-@st.cache_data(ttl=60)
 def fetch_sections_by_weekday() -> pd.DataFrame:
-    r = requests.get(f"{API_BASE}/sections_by_weekday", timeout=TIMEOUT)
-    if r.status_code != 200:
-        return pd.DataFrame(columns=["complaint_id","source","section","weekday","active_ms"])
-    df = pd.DataFrame(r.json())
+    df = _mirror_query(
+        "SELECT day, complaint_id, source, section, SUM(active_ms) AS active_ms FROM daily "
+        "WHERE day <> '' AND section <> '' GROUP BY day, complaint_id, source, section",
+        (), mirror().version,
+    )
+    if not df.empty:
+        df["weekday"] = pd.to_datetime(df["day"]).dt.day_name()
+        df = df.groupby(["complaint_id","source","section","weekday"], as_index=False)["active_ms"].sum()
     if df.empty:
         return df
     for c in ["complaint_id", "source", "section", "weekday", "active_ms"]:
@@ -206,12 +368,12 @@ def fetch_sections_by_weekday() -> pd.DataFrame:
     )
     df["weekday"] = df["weekday"].astype(cat)
     return df[["complaint_id","source","section","weekday","active_ms","HH:MM:SS"]]
-@st.cache_data(ttl=30)
 def fetch_events_for_complaint(complaint_id: str) -> pd.DataFrame:
-    r = requests.get(f"{API_BASE}/events", params={"complaint_id": complaint_id}, timeout=TIMEOUT)
-    if r.status_code != 200:
-        return pd.DataFrame(columns=["ts","email","team","complaint_id","source","section","reason","active_ms","idle_ms","page","session_id"])
-    df = pd.DataFrame(r.json())
+    df = _mirror_query(
+        "SELECT ts, email, team, complaint_id, source, section, reason, active_ms, idle_ms, page, session_id "
+        "FROM events WHERE complaint_id = ? ORDER BY ts ASC",
+        (complaint_id,), mirror().version,
+    )
     if df.empty:
         return df
     df["ts"] = pd.to_datetime(df["ts"], errors="coerce", utc=True).dt.tz_convert(TZ_NAME)
@@ -220,6 +382,9 @@ def fetch_events_for_complaint(complaint_id: str) -> pd.DataFrame:
     df["Active HH:MM:SS"] = df["active_ms"].apply(fmt_hms_from_ms)
     df["Idle HH:MM:SS"] = df["idle_ms"].apply(fmt_hms_from_ms)
     return df.sort_values("ts")
+live_on = st.sidebar.toggle("Live updates", value=True)
+sync_data(live_on)
+st.session_state["live_seen_version"] = mirror().version
 df = fetch_sessions()
 teams = df["team"].fillna("").replace("", "Unknown")
 all_ous = ["All Teams"] + sorted(teams.unique().tolist())
@@ -230,11 +395,7 @@ with st.sidebar:
     complaint_filter = st.text_input("Complaint/Transaction ID contains", "")
     min_minutes = st.number_input("Min ACTIVE minutes", min_value=0.0, value=0.0, step=0.5)
     if st.button("Force refresh data"):
-        for _fn in (fetch_sessions, fetch_by_section, fetch_events_for_complaint, fetch_sections_by_weekday):
-            try:
-                _fn.clear()
-            except Exception:
-                pass
+        sync_data(live_on, force=True)
         st.rerun()
     EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
     def api_post(path: str, payload: dict):
@@ -247,6 +408,7 @@ with st.sidebar:
         st.header("Weekly Data Export")
         with st.form("weekly_subscribe", clear_on_submit=True):
             sub_email = st.text_input("Email", placeholder="you@medtronic.com")
+            sub_team = st.selectbox("Team export", ["All Teams"] + SUBSCRIBE_TEAMS)
             c1, c2 = st.columns(2)
             do_sub = c1.form_submit_button("Subscribe", use_container_width=True)
             do_unsub = c2.form_submit_button("Unsubscribe", use_container_width=True)
@@ -257,7 +419,10 @@ with st.sidebar:
             else:
                 try:
                     if do_sub:
-                        api_post("/subscribe", {"email": e})
+                        api_post("/subscribe", {
+                            "email": e,
+                            "team": "" if sub_team == "All Teams" else sub_team,
+                        })
                         st.success("Subscribed! You’ll receive the weekly data export.")
                     else:
                         api_post("/unsubscribe", {"email": e})
@@ -594,4 +759,10 @@ st.download_button(
     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
     type="primary",
 )
-st.caption("Active time excludes ≥30s idle gaps; 30s–5m are counted as Idle; gaps ≥5m are ignored.")
\ No newline at end of file
+st.caption("Active time excludes ≥30s idle gaps; 30s–5m are counted as Idle; gaps ≥5m are ignored.")
+if live_on:
+    @st.fragment(run_every=LIVE_POLL_S)
+    def _live_watch():
+        if st.session_state.get("live_seen_version") != mirror().version:
+            st.rerun()
+    _live_watch()
\ No newline at end of file
@@ -17,10 +17,17 @@
     host: location.host,
     path: location.pathname,
   });
-  const API_URL   = "https://gch-timer-api.onrender.com/ingest";
+  const API_URL   = "https://gch-timer-api.onrender.com/ingest_bulk";
   const IDLE_MIN_MS     = 30 * 1000;
   const IDLE_IGNORE_MS  = 5  * 60 * 1000;
   const HEARTBEAT       = 60 * 1000;
+  const REFRESH_DEBOUNCE_MS = 400;
+  const TEXT_SCAN_MS    = 15 * 1000;
+  const BATCH_MAX       = 5;
+  const BATCH_FLUSH_MS  = 2 * 60 * 1000;
+  const REASON_CODES = {
+    open: "o", heartbeat: "h", unload: "u", visibility: "v", section_change: "s", complaint_change: "c",
+  };
   const EMAIL_KEY = "gch_timer_email";
   const TEAM_KEY    = "gch_timer_ou";
   const ALLOWED_TEAMS = ["Aortic","CAS","CRDN","ECT","PVH","SVT","TCT", "CPT", "DS", "PCS & CDS", "PM", "MCS"]
@@ -67,12 +74,6 @@
     }
     return false;
   }
-  function shouldAccrueNow() {
-    if (document.visibilityState !== "visible") return false;
-    if (!document.hasFocus()) return false;
-    if (!isCW() && hasVisibleCWIframeOverlay()) return false;
-    return true;
-  }
   function fromCWDom() {
     if (!isCW()) return "";
     try {
@@ -100,15 +101,25 @@
     let m=b.match(/\bSR[:#\s-]*([0-9]{6,})\b/i); if(m) return m[1];
     m=b.match(/\bTransaction\s*ID[:#\s-]*([0-9]{6,})\b/i); if(m) return m[1]; return "";
   }
-  function findComplaintId() {
-    const id =
+  let textScanAt = 0, textScanDirty = true, textScanId = "";
+  function fromTextThrottled() {
+    const now = Date.now();
+    if (textScanDirty && now - textScanAt >= TEXT_SCAN_MS) {
+      textScanAt = now;
+      textScanDirty = false;
+      textScanId = fromText();
+    }
+    return textScanId;
+  }
+  function findRawComplaintId() {
+    return (
       fromCWDom() ||
       fromGuideSideNav() ||
       fromUrl() ||
       fromTitle() ||
-      fromText() ||
-      "";
-    return isValidComplaintId(id) ? id : "";
+      fromTextThrottled() ||
+      ""
+    );
   }
   function findSection(){
     if (isCW()) return "Complaint Wizard";
@@ -123,39 +134,62 @@
   let lastTick = Date.now();
   let activeMs=0, idleMs=0, lastSentActiveMs=0, lastSentIdleMs=0;
   const sessionId=Math.random().toString(36).slice(2);
+  let eventSeq=0;
+  function newEventId(){
+    eventSeq += 1;
+    if (crypto?.randomUUID) return crypto.randomUUID();
+    return `${sessionId}-${Date.now().toString(36)}-${eventSeq}`;
+  }
   let started=false;
-  const onAct=()=>{ lastActivity=Date.now(); };
+  let overlayVisible = false, accruing = false;
+  let lastRejected = "", refreshTimer = null;
+  const onAct=()=>{
+    const now = Date.now();
+    if (now - lastActivity >= IDLE_MIN_MS) accrue();
+    lastActivity = now;
+    if (!started) scheduleRefresh();
+  };
   ["click","keydown","mousemove","wheel","touchstart"].forEach(ev =>
     window.addEventListener(ev,onAct,{passive:true})
   );
   function accrue(){
     const now = Date.now();
-    const dt = now - lastTick;
-    if (!shouldAccrueNow()) {
-      lastTick = now;
-      return;
-    }
-    if(!complaintId){
-      lastTick = now;
-      return;
-    }
-    if(!lastActivity){
-      lastTick = now;
-      return;
-    }
-    const idleGap = now - lastActivity;
-    if (idleGap < IDLE_MIN_MS) {
-      activeMs += dt;
-    } else if (idleGap < IDLE_IGNORE_MS) {
-      idleMs += dt;
-    } else {
-    }
+    const from = lastTick;
     lastTick = now;
+    if (!accruing || !complaintId || !lastActivity) return;
+    const activeEnd = lastActivity + IDLE_MIN_MS;
+    const idleEnd   = lastActivity + IDLE_IGNORE_MS;
+    activeMs += Math.max(0, Math.min(now, activeEnd) - from);
+    idleMs   += Math.max(0, Math.min(now, idleEnd) - Math.max(from, activeEnd));
+  }
+  function updateAccruing(){
+    const next = document.visibilityState === "visible" && document.hasFocus() && !overlayVisible;
+    if (next === accruing) return;
+    accrue();
+    accruing = next;
+  }
+  let queue=[], flushTimer=null;
+  function encodeBatch(items){
+    const lines=[]; let last={};
+    for (const {ctx, delta} of items){
+      const diff={};
+      for (const k in ctx) if (ctx[k]!==last[k]) diff[k]=ctx[k];
+      if (Object.keys(diff).length) lines.push(JSON.stringify(diff));
+      lines.push(JSON.stringify(delta));
+      last=ctx;
+    }
+    return lines.join("\n")+"\n";
+  }
+  async function gzip(text){
+    if (typeof CompressionStream === "undefined") return new Blob([text]);
+    const stream = new Blob([text]).stream().pipeThrough(new CompressionStream("gzip"));
+    return await new Response(stream).blob();
   }
   function post(body){
     return fetch(API_URL, {
       method: "POST",
-      headers: {"Content-Type":"application/json"},
+      headers: {"Content-Type":"application/x-ndjson"},
+      keepalive: true,
       body
     }).then(async (res) => {
       if (!res.ok) {
@@ -170,6 +204,19 @@
       throw err;
     });
   }
+  function takeBatch(){
+    clearTimeout(flushTimer);
+    flushTimer = null;
+    const items = queue;
+    queue = [];
+    return items.length ? encodeBatch(items) : "";
+  }
+  async function flush(){
+    const text = takeBatch();
+    if (!text) return;
+    const body = await gzip(text);
+    post(body).catch(() => setTimeout(() => post(body).catch(() => {}), 1000));
+  }
   function sendDelta(reason, sync = false) {
     if (!complaintId) return;
     const dActive = Math.max(0, Math.round(activeMs - lastSentActiveMs));
@@ -179,26 +226,27 @@
     }
     lastSentActiveMs = activeMs;
     lastSentIdleMs   = idleMs;
-    const payload = {
-      ts: new Date().toISOString(),
-      email,
-      team,
-      complaint_id: complaintId,
-      source: getSource(),
-      section,
-      reason,
-      active_ms: dActive,
-      idle_ms: dIdle,
-      page: location.href,
-      session_id: sessionId
+    const ctx = {
+      s: sessionId,
+      e: email,
+      t: team,
+      o: getSource(),
+      c: complaintId,
+      x: section,
+      p: location.href
     };
-    log("sendDelta", payload);
-    const body = JSON.stringify(payload);
+    const delta = [Date.now(), REASON_CODES[reason] || reason, dActive, dIdle, newEventId()];
+    log("sendDelta", reason, delta);
+    queue.push({ctx, delta});
     if (sync && navigator.sendBeacon) {
-      navigator.sendBeacon(API_URL, new Blob([body], { type: "application/json" }));
+      navigator.sendBeacon(API_URL, new Blob([takeBatch()], { type: "text/plain" }));
       return;
     }
-    post(body).catch(() => setTimeout(() => post(body).catch(() => {}), 1000));
+    if (queue.length >= BATCH_MAX || reason === "visibility" || reason === "unload") {
+      flush();
+    } else if (!flushTimer) {
+      flushTimer = setTimeout(flush, BATCH_FLUSH_MS);
+    }
   }
   function maybeSend(reason) {
     if (!complaintId) return;
@@ -206,13 +254,19 @@
       sendDelta(reason);
     }
   }
+  function scheduleRefresh(){
+    if (refreshTimer) return;
+    refreshTimer = setTimeout(() => { refreshTimer = null; refreshKeys(); }, REFRESH_DEBOUNCE_MS);
+  }
   function refreshKeys(){
-    const c = findComplaintId();
-    if (!c) {
-      const raw =
-        fromCWDom() || fromGuideSideNav() || fromUrl() || fromTitle() || fromText() || "";
-      if (raw) log("rejected complaint id (not 6/7…):", raw);
+    const raw = findRawComplaintId();
+    const c = isValidComplaintId(raw) ? raw : "";
+    if (!c && raw && raw !== lastRejected) {
+      lastRejected = raw;
+      log("rejected complaint id (not 6/7…):", raw);
     }
+    overlayVisible = hasVisibleCWIframeOverlay();
+    updateAccruing();
     const s = findSection();
     if (c && c !== complaintId) {
       accrue();
@@ -315,12 +369,22 @@
     if (window.top === window && (!email || !ALLOWED_TEAMS.includes(team))) {
       showSetupPanel(email, team);
     }
-    const mo=new MutationObserver(refreshKeys);
-    if(document.body) mo.observe(document.body,{childList:true,subtree:true});
-    setInterval(refreshKeys,1500);
-    setInterval(()=>accrue(),1000);
-    setInterval(()=>{ accrue(); refreshKeys(); maybeSend("heartbeat"); },HEARTBEAT);
-    document.addEventListener("visibilitychange",()=>{ accrue(); maybeSend("visibility"); });
+    const mo=new MutationObserver(muts => {
+      if (panelRoot && muts.every(m => panelRoot.contains(m.target))) return;
+      if (document.visibilityState !== "visible") return;
+      textScanDirty = true;
+      scheduleRefresh();
+    });
+    mo.observe(document.documentElement,{
+      childList:true, subtree:true, attributes:true, attributeFilter:["class","style","hidden","src","title"]
+    });
+    window.addEventListener("hashchange", scheduleRefresh);
+    window.addEventListener("popstate", scheduleRefresh);
+    window.addEventListener("focus", updateAccruing);
+    window.addEventListener("blur", () => setTimeout(updateAccruing, 0));
+    setInterval(()=>{ accrue(); updateAccruing(); refreshKeys(); maybeSend("heartbeat"); },HEARTBEAT);
+    document.addEventListener("visibilitychange",()=>{ if (document.visibilityState === "visible") textScanDirty = true; accrue(); updateAccruing(); maybeSend("visibility"); scheduleRefresh(); });
     window.addEventListener("beforeunload",()=>{ accrue(); sendDelta("unload", true); });
+    refreshKeys();
   });
 })();
\ No newline at end of file
@@ -1,26 +1,42 @@
 # server/main.py
+import time
+_BOOT_T0 = time.perf_counter()
 import os
+import asyncio
+import json
 import io
+import csv
 import smtplib
 import secrets
-from datetime import datetime
+import threading
+import cProfile
+import functools
+import pstats
+from contextlib import asynccontextmanager
+from contextvars import ContextVar, copy_context
+import uuid
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
 from email.message import EmailMessage
 import re
 import pytz
-import pandas as pd
-from apscheduler.schedulers.background import BackgroundScheduler
 from fastapi import FastAPI, HTTPException, status
-from fastapi.responses import StreamingResponse
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.pool import NullPool
 import base64
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail, Attachment, FileContent, FileName, FileType, Disposition
 from pathlib import Path
 import tempfile
+from typing import TYPE_CHECKING
 from fastapi import Query
+if TYPE_CHECKING:
+    import pandas as pd
 SUBSCRIBERS_TOKEN = os.getenv("SUBSCRIBERS_TOKEN", "1234")
 def _active_subscriber_emails() -> list[str]:
     with engine.begin() as conn:
@@ -46,6 +62,29 @@ CREATE TABLE IF NOT EXISTS events (
   session_id   TEXT
 );
 """
+EVENT_COLUMNS = [
+    "ts", "email", "team", "complaint_id", "source", "section",
+    "reason", "active_ms", "idle_ms", "page", "session_id",
+]
+DDL_MAIL = """
+CREATE TABLE IF NOT EXISTS mail_attachments (
+  id          TEXT PRIMARY KEY,
+  filename    TEXT,
+  content_b64 TEXT,
+  created_ts  TEXT
+);
+CREATE TABLE IF NOT EXISTS mail_outbox (
+  id            TEXT PRIMARY KEY,
+  recipient     TEXT,
+  subject       TEXT,
+  attachment_id TEXT,
+  status        TEXT DEFAULT 'pending',
+  attempts      INTEGER DEFAULT 0,
+  last_error    TEXT,
+  created_ts    TEXT,
+  sent_ts       TEXT
+);
+"""
 DDL_SUBSCRIBERS = """
 CREATE TABLE IF NOT EXISTS subscribers (
   email      TEXT PRIMARY KEY,
@@ -58,7 +97,8 @@ SUBSCRIBERS_CSV_PATH = os.getenv(
     "SUBSCRIBERS_CSV_PATH",
     str(Path(__file__).with_name("subscribers.csv")) 
 )
-def _get_subscribers_df() -> pd.DataFrame:
+def _get_subscribers_df() -> "pd.DataFrame":
+    import pandas as pd
     with engine.begin() as conn:
         return pd.read_sql_query(
             "SELECT email, team, is_active, created_ts FROM subscribers ORDER BY created_ts DESC",
@@ -72,74 +112,435 @@ def _write_subscribers_csv() -> None:
         df.to_csv(tmp.name, index=False)
         tmp_path = Path(tmp.name)
     tmp_path.replace(p)
-def ensure_schema(engine):
+DDL_SCHEMA_VERSION = """
+CREATE TABLE IF NOT EXISTS schema_version (
+  version    INTEGER PRIMARY KEY,
+  name       TEXT,
+  applied_ts TEXT
+);
+"""
+EVENT_COLUMN_TYPES = [
+    ("team", "TEXT"),
+    ("complaint_id", "TEXT"),
+    ("section", "TEXT"),
+    ("reason", "TEXT"),
+    ("active_ms", "BIGINT"),
+    ("idle_ms", "BIGINT DEFAULT 0"),
+    ("page", "TEXT"),
+    ("session_id", "TEXT"),
+    ("source", "TEXT"),
+]
+def _is_postgres(conn) -> bool:
+    return conn.engine.url.get_backend_name().startswith("postgresql")
+def _m001_base_tables(conn) -> None:
+    conn.exec_driver_sql(DDL)
+    conn.exec_driver_sql(DDL_SUBSCRIBERS)
+    if _is_postgres(conn):
+        for col, typ in EVENT_COLUMN_TYPES:
+            conn.exec_driver_sql(f"ALTER TABLE events ADD COLUMN IF NOT EXISTS {col} {typ}")
+        return
+    cols = {r[1] for r in conn.exec_driver_sql("PRAGMA table_info(events)").fetchall()}
+    for col, typ in EVENT_COLUMN_TYPES:
+        if col not in cols:
+            conn.exec_driver_sql(f"ALTER TABLE events ADD COLUMN {col} {typ}")
+def _m002_mail_outbox(conn) -> None:
+    for stmt in DDL_MAIL.split(";"):
+        if stmt.strip():
+            conn.exec_driver_sql(stmt)
+BACKFILL_BATCH_ROWS = int(os.getenv("BACKFILL_BATCH_ROWS", "5000"))
+BACKFILL_PAUSE_S = float(os.getenv("BACKFILL_PAUSE_S", "0.2"))
+ONLINE_MIGRATION_HOURS = os.getenv("ONLINE_MIGRATION_HOURS", "")
+def _in_migration_window() -> bool:
+    if not ONLINE_MIGRATION_HOURS:
+        return True
+    start, end = (int(h) for h in ONLINE_MIGRATION_HOURS.split("-", 1))
+    hour = datetime.now(pytz.timezone("America/Chicago")).hour
+    return start <= hour < end if start <= end else (hour >= start or hour < end)
+def _wait_for_migration_window() -> None:
+    while not _in_migration_window():
+        time.sleep(60)
+def _backfill(engine, table: str, set_sql: str, where_sql: str, params: dict | None = None,
+              returning: str = "", on_rows=None) -> int:
+    key = "ctid" if engine.url.get_backend_name().startswith("postgresql") else "rowid"
+    sql = text(f"""
+        UPDATE {table} SET {set_sql}
+        WHERE {key} IN (SELECT {key} FROM {table} WHERE {where_sql} LIMIT {BACKFILL_BATCH_ROWS})
+        {f"RETURNING {returning}" if returning else ""}
+    """)
+    total = 0
+    while True:
+        _wait_for_migration_window()
+        with engine.begin() as conn:
+            if key == "ctid":
+                conn.exec_driver_sql("SELECT pg_current_xact_id()")
+            result = conn.execute(sql, params or {})
+            if on_rows:
+                rows = result.fetchall()
+                on_rows(conn, rows)
+                n = len(rows)
+            else:
+                n = result.rowcount
+        total += n
+        if n < BACKFILL_BATCH_ROWS:
+            return total
+        time.sleep(BACKFILL_PAUSE_S)
+def _create_index_online(engine, name: str, table: str, columns: str, unique: bool = False) -> None:
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    if engine.url.get_backend_name().startswith("postgresql"):
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql(f"CREATE {kind} CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})")
+        return
     with engine.begin() as conn:
-        conn.exec_driver_sql(DDL)
-        conn.exec_driver_sql(DDL_SUBSCRIBERS)
-    backend = engine.url.get_backend_name()
-    if backend.startswith("postgresql"):
-        migrations = [
-            "ALTER TABLE events ADD COLUMN IF NOT EXISTS team TEXT",
-            "ALTER TABLE events ADD COLUMN IF NOT EXISTS complaint_id TEXT",
-            "ALTER TABLE events ADD COLUMN IF NOT EXISTS section TEXT",
-            "ALTER TABLE events ADD COLUMN IF NOT EXISTS reason TEXT",
-            "ALTER TABLE events ADD COLUMN IF NOT EXISTS active_ms BIGINT",
-            "ALTER TABLE events ADD COLUMN IF NOT EXISTS idle_ms BIGINT DEFAULT 0",
-            "ALTER TABLE events ADD COLUMN IF NOT EXISTS page TEXT",
-            "ALTER TABLE events ADD COLUMN IF NOT EXISTS session_id TEXT",
-            "ALTER TABLE events ADD COLUMN IF NOT EXISTS source TEXT",
-        ]
-        for sql in migrations:
-            with engine.begin() as conn:
-                conn.exec_driver_sql(sql)
+        conn.exec_driver_sql(f"CREATE {kind} IF NOT EXISTS {name} ON {table} ({columns})")
+def _m003_events_complaint_index(engine) -> None:
+    _create_index_online(engine, "idx_events_complaint_ts", "events", "complaint_id, ts")
+DDL_SYNC_STATE = """
+CREATE TABLE IF NOT EXISTS sync_state (
+  key   TEXT PRIMARY KEY,
+  value TEXT
+);
+"""
+def _m004_events_seq(conn) -> None:
+    conn.exec_driver_sql(DDL_SYNC_STATE)
+    if not _is_postgres(conn):
         return
+    conn.exec_driver_sql("CREATE SEQUENCE IF NOT EXISTS events_seq")
+    conn.exec_driver_sql("ALTER TABLE events ADD COLUMN IF NOT EXISTS seq BIGINT")
+    conn.exec_driver_sql("ALTER TABLE events ALTER COLUMN seq SET DEFAULT nextval('events_seq')")
+def _m005_events_seq_backfill(engine) -> None:
+    if not engine.url.get_backend_name().startswith("postgresql"):
+        return
+    def rollup(conn, rows) -> None:
+        if conn.exec_driver_sql("SELECT 1 FROM sync_state WHERE key = 'daily_backfill' FOR UPDATE").first():
+            _upsert_daily(conn, _daily_rollup(rows))
+            _bump_daily_gen(conn)
+    _backfill(engine, "events", "seq = nextval('events_seq')", "seq IS NULL",
+              returning=", ".join(DAILY_SOURCE_COLUMNS), on_rows=rollup)
+    _create_index_online(engine, "idx_events_seq", "events", "seq")
+DDL_DAILY_TOTALS = """
+CREATE TABLE IF NOT EXISTS daily_totals (
+  day          TEXT NOT NULL,
+  team         TEXT NOT NULL,
+  email        TEXT NOT NULL,
+  complaint_id TEXT NOT NULL,
+  source       TEXT NOT NULL,
+  section      TEXT NOT NULL,
+  active_ms    BIGINT DEFAULT 0,
+  idle_ms      BIGINT DEFAULT 0,
+  last_ts      TEXT,
+  PRIMARY KEY (day, team, email, complaint_id, source, section)
+);
+"""
+DAILY_KEY = ("day", "team", "email", "complaint_id", "source", "section")
+DAILY_SOURCE_COLUMNS = ["ts", "team", "email", "complaint_id", "source", "section", "active_ms", "idle_ms"]
+DAILY_TZ = pytz.timezone("America/Chicago")
+DAILY_UPSERT_SQL = text("""
+    INSERT INTO daily_totals (day, team, email, complaint_id, source, section, active_ms, idle_ms, last_ts)
+    VALUES (:day, :team, :email, :complaint_id, :source, :section, :active_ms, :idle_ms, :last_ts)
+    ON CONFLICT (day, team, email, complaint_id, source, section) DO UPDATE SET
+      active_ms = daily_totals.active_ms + excluded.active_ms,
+      idle_ms   = daily_totals.idle_ms + excluded.idle_ms,
+      last_ts   = CASE WHEN daily_totals.last_ts IS NULL OR excluded.last_ts > daily_totals.last_ts
+                       THEN excluded.last_ts ELSE daily_totals.last_ts END
+""").execution_options(query_name="daily_totals_upsert")
+def _chicago_day(ts: str) -> str:
+    try:
+        t = datetime.fromisoformat((ts or "").strip())
+    except ValueError:
+        return ""
+    if t.tzinfo is None:
+        t = pytz.utc.localize(t)
+    return t.astimezone(DAILY_TZ).date().isoformat()
+def _daily_rollup(rows, agg: dict | None = None) -> dict[tuple, list]:
+    agg = {} if agg is None else agg
+    for ts, team, email, complaint_id, source, section, active_ms, idle_ms in rows:
+        key = (_chicago_day(ts), (team or "").strip(), email or "", complaint_id or "",
+               source or "", (section or "").strip())
+        a = agg.get(key)
+        if a is None:
+            agg[key] = [int(active_ms or 0), int(idle_ms or 0), ts]
+            continue
+        a[0] += int(active_ms or 0)
+        a[1] += int(idle_ms or 0)
+        if ts and (a[2] is None or ts > a[2]):
+            a[2] = ts
+    return agg
+def _upsert_daily(conn, agg: dict[tuple, list]) -> None:
+    if agg:
+        conn.execute(DAILY_UPSERT_SQL, [
+            {**dict(zip(DAILY_KEY, key)), "active_ms": a[0], "idle_ms": a[1], "last_ts": a[2]}
+            for key, a in agg.items()
+        ])
+def _daily_backfill_pending(conn) -> bool:
+    return conn.exec_driver_sql("SELECT 1 FROM sync_state WHERE key = 'daily_backfill'").first() is not None
+def _live_daily_totals(conn) -> list[dict]:
+    rows = conn.execute(text(f"SELECT {', '.join(DAILY_SOURCE_COLUMNS)} FROM events")
+                        .execution_options(query_name="daily_live")).fetchall()
+    return [{**dict(zip(DAILY_KEY, key)), "active_ms": a[0], "idle_ms": a[1], "last_ts": a[2]}
+            for key, a in _daily_rollup(rows).items()]
+def _set_sync_state(conn, key: str, value: str) -> None:
+    conn.execute(text("""
+        INSERT INTO sync_state (key, value) VALUES (:key, :value)
+        ON CONFLICT (key) DO UPDATE SET value = excluded.value
+    """), {"key": key, "value": value})
+def _bump_daily_gen(conn=None) -> None:
+    if conn is None:
+        with engine.begin() as conn:
+            _set_sync_state(conn, "daily_gen", uuid.uuid4().hex[:12])
+        return
+    _set_sync_state(conn, "daily_gen", uuid.uuid4().hex[:12])
+def _m006_daily_totals(conn) -> None:
+    conn.exec_driver_sql(DDL_DAILY_TOTALS)
+    key = "seq" if _is_postgres(conn) else "rowid"
+    head = conn.exec_driver_sql(f"SELECT COALESCE(MAX({key}), 0) FROM events").scalar()
+    _set_sync_state(conn, "daily_backfill", f"0:{head}")
+def _m007_events_event_id(conn) -> None:
+    if _is_postgres(conn):
+        conn.exec_driver_sql("ALTER TABLE events ADD COLUMN IF NOT EXISTS event_id TEXT")
+        return
+    cols = {r[1] for r in conn.exec_driver_sql("PRAGMA table_info(events)").fetchall()}
+    if "event_id" not in cols:
+        conn.exec_driver_sql("ALTER TABLE events ADD COLUMN event_id TEXT")
+def _m008_events_event_id_index(engine) -> None:
+    _create_index_online(engine, "idx_events_event_id", "events", "event_id", unique=True)
+def _m009_mail_outbox_claim(conn) -> None:
+    if _is_postgres(conn):
+        conn.exec_driver_sql("ALTER TABLE mail_outbox ADD COLUMN IF NOT EXISTS claimed_ts TEXT")
+        return
+    cols = {r[1] for r in conn.exec_driver_sql("PRAGMA table_info(mail_outbox)").fetchall()}
+    if "claimed_ts" not in cols:
+        conn.exec_driver_sql("ALTER TABLE mail_outbox ADD COLUMN claimed_ts TEXT")
+def _m010_daily_totals_backfill(engine) -> None:
+    key = "seq" if engine.url.get_backend_name().startswith("postgresql") else "rowid"
+    sql = text(f"""
+        SELECT {key}, {', '.join(DAILY_SOURCE_COLUMNS)} FROM events
+        WHERE {key} > :done AND {key} <= :head
+        ORDER BY {key}
+        LIMIT {BACKFILL_BATCH_ROWS}
+    """)
+    while True:
+        _wait_for_migration_window()
+        with engine.begin() as conn:
+            conn.exec_driver_sql("UPDATE sync_state SET value = value WHERE key = 'daily_backfill'")
+            state = conn.exec_driver_sql("SELECT value FROM sync_state WHERE key = 'daily_backfill'").scalar()
+            if not state:
+                return
+            done, head = (int(v) for v in state.split(":"))
+            rows = conn.execute(sql, {"done": done, "head": head}).fetchall()
+            if not rows:
+                conn.exec_driver_sql("DELETE FROM sync_state WHERE key = 'daily_backfill'")
+                return
+            _upsert_daily(conn, _daily_rollup(r[1:] for r in rows))
+            _set_sync_state(conn, "daily_backfill", f"{rows[-1][0]}:{head}")
+        _bump_daily_gen()
+        time.sleep(BACKFILL_PAUSE_S)
+MIGRATIONS = [
+    (1, "events and subscribers base columns", _m001_base_tables, False),
+    (2, "mail outbox", _m002_mail_outbox, False),
+    (3, "events (complaint_id, ts) index", _m003_events_complaint_index, True),
+    (4, "events sequence and sync state", _m004_events_seq, False),
+    (5, "events sequence backfill and index", _m005_events_seq_backfill, True),
+    (6, "daily totals by team, email, complaint and section", _m006_daily_totals, False),
+    (7, "events client event id", _m007_events_event_id, False),
+    (8, "events unique event id index", _m008_events_event_id_index, True),
+    (9, "mail outbox delivery claim", _m009_mail_outbox_claim, False),
+    (10, "daily totals backfill", _m010_daily_totals_backfill, True),
+]
+def _applied_migrations(engine) -> set[int]:
+    with engine.begin() as conn:
+        conn.exec_driver_sql(DDL_SCHEMA_VERSION)
+        return {r[0] for r in conn.exec_driver_sql("SELECT version FROM schema_version").fetchall()}
+def _record_migration(conn, version: int, name: str) -> None:
+    conn.execute(text("""
+        INSERT INTO schema_version (version, name, applied_ts)
+        VALUES (:version, :name, :applied_ts)
+        ON CONFLICT (version) DO NOTHING
+    """), {"version": version, "name": name, "applied_ts": datetime.now(pytz.utc).isoformat()})
+def ensure_schema(engine):
+    applied = _applied_migrations(engine)
+    for version, name, fn, online in MIGRATIONS:
+        if online or version in applied:
+            continue
+        t0 = time.perf_counter()
+        with engine.begin() as conn:
+            fn(conn)
+            _record_migration(conn, version, name)
+        print(f"[schema] applied {version} ({name}) in {(time.perf_counter() - t0) * 1000:.0f} ms")
     with engine.begin() as conn:
-        cols = [r[1] for r in conn.exec_driver_sql("PRAGMA table_info(events)").fetchall()]
-    to_add = []
-    if "team" not in cols:
-        to_add.append("ALTER TABLE events ADD COLUMN team TEXT")
-    if "complaint_id" not in cols:
-        to_add.append("ALTER TABLE events ADD COLUMN complaint_id TEXT")
-    if "section" not in cols:
-        to_add.append("ALTER TABLE events ADD COLUMN section TEXT")
-    if "reason" not in cols:
-        to_add.append("ALTER TABLE events ADD COLUMN reason TEXT")
-    if "active_ms" not in cols:
-        to_add.append("ALTER TABLE events ADD COLUMN active_ms BIGINT")
-    if "idle_ms" not in cols:
-        to_add.append("ALTER TABLE events ADD COLUMN idle_ms BIGINT DEFAULT 0")
-    if "page" not in cols:
-        to_add.append("ALTER TABLE events ADD COLUMN page TEXT")
-    if "session_id" not in cols:
-        to_add.append("ALTER TABLE events ADD COLUMN session_id TEXT")
-    if "source" not in cols:
-        to_add.append("ALTER TABLE events ADD COLUMN source TEXT")
-    for sql in to_add:
+        conn.execute(text("INSERT INTO sync_state (key, value) VALUES ('epoch', :v) ON CONFLICT (key) DO NOTHING"),
+                     {"v": uuid.uuid4().hex[:12]})
+def run_online_migrations(engine):
+    applied = _applied_migrations(engine)
+    for version, name, fn, online in MIGRATIONS:
+        if not online or version in applied:
+            continue
+        _wait_for_migration_window()
+        t0 = time.perf_counter()
+        fn(engine)
         with engine.begin() as conn:
-            conn.exec_driver_sql(sql)
+            _record_migration(conn, version, name)
+        print(f"[schema] applied online {version} ({name}) in {(time.perf_counter() - t0) * 1000:.0f} ms")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = (1e4, 1e5, 1e6, 5e6, 1e7, 2.5e7, 5e7, 1e8)
+METRIC_META = {
+    "gch_http_requests_total": ("counter", "HTTP requests by route, method and status."),
+    "gch_http_request_duration_seconds": ("histogram", "HTTP request latency by route."),
+    "gch_db_query_duration_seconds": ("histogram", "Database statement latency by named query."),
+    "gch_ingest_rows_total": ("counter", "Event rows accepted by /ingest."),
+    "gch_ingest_duplicates_total": ("counter", "Replayed event ids dropped by /ingest, by where they were caught."),
+    "gch_export_build_seconds": ("histogram", "Time to render an export workbook."),
+    "gch_export_bytes": ("histogram", "Size of rendered export workbooks."),
+    "gch_mail_deliveries_total": ("counter", "Outbox delivery results by outcome."),
+    "gch_scheduler_jobs_total": ("counter", "Scheduler job runs by job and outcome."),
+}
+_metrics_lock = threading.Lock()
+_counters: dict[tuple[str, tuple], float] = {}
+_histograms: dict[tuple[str, tuple], list[float]] = {}
+def _inc(name: str, labels: tuple = (), value: float = 1) -> None:
+    with _metrics_lock:
+        _counters[(name, labels)] = _counters.get((name, labels), 0) + value
+def _observe(name: str, labels: tuple, value: float, buckets: tuple = LATENCY_BUCKETS) -> None:
+    with _metrics_lock:
+        h = _histograms.get((name, labels))
+        if h is None:
+            h = _histograms[(name, labels)] = [0.0] * (len(buckets) + 2)
+        for i, b in enumerate(buckets):
+            if value <= b:
+                h[i] += 1
+        h[-2] += value
+        h[-1] += 1
+def _fmt_labels(labels: tuple, extra: tuple = ()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+def _render_metrics() -> str:
+    with _metrics_lock:
+        counters = dict(_counters)
+        histograms = {k: list(v) for k, v in _histograms.items()}
+    lines = []
+    for name, (kind, help_text) in METRIC_META.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "counter":
+            for (n, labels), v in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{name}{_fmt_labels(labels)} {v:g}")
+            continue
+        buckets = BYTES_BUCKETS if name == "gch_export_bytes" else LATENCY_BUCKETS
+        for (n, labels), h in sorted(histograms.items()):
+            if n != name:
+                continue
+            for b, c in zip(buckets, h):
+                lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', f'{b:g}'),))} {c:g}")
+            lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', '+Inf'),))} {h[-1]:g}")
+            lines.append(f"{name}_sum{_fmt_labels(labels)} {h[-2]:.6f}")
+            lines.append(f"{name}_count{_fmt_labels(labels)} {h[-1]:g}")
+    return "\n".join(lines) + "\n"
+QUERY_NAME_RE = re.compile(
+    r"^\s*(\w+)(?:.*?\b(?:FROM|INTO|UPDATE|TABLE)\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+))?", re.I | re.S
+)
+def _query_name(statement: str, context) -> str:
+    name = getattr(context, "execution_options", {}).get("query_name") if context is not None else None
+    if name:
+        return name
+    m = QUERY_NAME_RE.match(statement or "")
+    if not m:
+        return "other"
+    return "_".join(p.lower() for p in m.groups() if p)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "40"))
+_request_profile: ContextVar[dict | None] = ContextVar("_request_profile", default=None)
+def _log_slow_query(name: str, statement: str, parameters, elapsed_ms: float, role: str = "write") -> None:
+    sql = " ".join((statement or "").split())
+    params = repr(parameters)
+    if len(params) > 500:
+        params = params[:500] + "..."
+    print(f"[slow-query] {elapsed_ms:.1f}ms engine={role} query={name} sql={sql[:1000]} params={params}")
+def _instrument_engine(eng, role: str = "write") -> None:
+    @event.listens_for(eng, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_t0", []).append(time.perf_counter())
+    @event.listens_for(eng, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("query_t0")
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        name = _query_name(statement, context)
+        _observe("gch_db_query_duration_seconds", (("engine", role), ("query", name)), elapsed)
+        if SLOW_QUERY_MS > 0 and elapsed * 1000 >= SLOW_QUERY_MS:
+            _log_slow_query(name, statement, parameters, elapsed * 1000, role)
+        prof = _request_profile.get()
+        if prof is not None:
+            prof["db_ms"] += elapsed * 1000
+            prof["db_queries"].append({"engine": role, "query": name, "ms": round(elapsed * 1000, 3)})
+def _normalize_db_url(url: str) -> str:
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql+psycopg://", 1)
+    if url.startswith("postgresql://") and not url.startswith("postgresql+psycopg://"):
+        return url.replace("postgresql://", "postgresql+psycopg://", 1)
+    return url
 DB_URL = os.getenv("DATABASE_URL")
-if DB_URL:
-    if DB_URL.startswith("postgres://"):
-        DB_URL = DB_URL.replace("postgres://", "postgresql+psycopg://", 1)
-    elif DB_URL.startswith("postgresql://") and not DB_URL.startswith("postgresql+psycopg://"):
-        DB_URL = DB_URL.replace("postgresql://", "postgresql+psycopg://", 1)
-    engine = create_engine(DB_URL, pool_pre_ping=True)
-else:
-    DB_PATH = os.getenv("DB_PATH", "events.db")
-    engine = create_engine(
-        f"sqlite:///{DB_PATH}",
+DB_READ_URL = os.getenv("DATABASE_READ_URL")
+READ_POOL_SIZE = int(os.getenv("READ_POOL_SIZE", "5"))
+DB_SHARDS = max(1, int(os.getenv("DB_SHARDS", "1")))
+DB_SHARD_BY = os.getenv("DB_SHARD_BY", "session").strip().lower()
+def _sqlite_engine(path: str):
+    eng = create_engine(
+        f"sqlite:///{path}",
         connect_args={"check_same_thread": False},
         poolclass=NullPool,
         pool_pre_ping=True,
     )
-    with engine.begin() as conn:
+    with eng.begin() as conn:
         conn.exec_driver_sql("PRAGMA journal_mode=WAL;")
         conn.exec_driver_sql("PRAGMA busy_timeout=5000;")
+    return eng
+def _sqlite_read_engine(path: str):
+    return create_engine(
+        f"sqlite:///file:{Path(path).resolve()}?mode=ro&uri=true",
+        connect_args={"check_same_thread": False, "timeout": 5},
+        poolclass=NullPool,
+        pool_pre_ping=True,
+    )
+if DB_URL:
+    DB_URL = _normalize_db_url(DB_URL)
+    engine = create_engine(DB_URL, pool_pre_ping=True)
+else:
+    DB_PATH = os.getenv("DB_PATH", "events.db")
+    engine = _sqlite_engine(DB_PATH)
+_instrument_engine(engine)
 ensure_schema(engine)
-try:
-    _write_subscribers_csv()
-except Exception as e:
-    print(f"[subscribers.csv] initial write failed: {e}")
+if DB_READ_URL or DB_URL:
+    read_engine = create_engine(_normalize_db_url(DB_READ_URL or DB_URL), pool_pre_ping=True, pool_size=READ_POOL_SIZE)
+else:
+    read_engine = _sqlite_read_engine(DB_PATH)
+_instrument_engine(read_engine, "read")
+if read_engine.url.get_backend_name().startswith("postgresql"):
+    read_engine = read_engine.execution_options(postgresql_readonly=True)
+shard_engines, shard_read_engines = [engine], [read_engine]
+if DB_SHARDS > 1 and DB_URL:
+    print("[shards] DB_SHARDS only applies to SQLite; ignored because DATABASE_URL is set")
+elif DB_SHARDS > 1:
+    if DB_SHARD_BY not in ("session", "day"):
+        raise RuntimeError("DB_SHARD_BY must be 'session' or 'day'")
+    for i in range(1, DB_SHARDS):
+        p = Path(DB_PATH)
+        path = str(p.with_name(f"{p.stem}.shard{i}{p.suffix}"))
+        eng = _sqlite_engine(path)
+        _instrument_engine(eng)
+        ensure_schema(eng)
+        ro = _sqlite_read_engine(path)
+        _instrument_engine(ro, "read")
+        shard_engines.append(eng)
+        shard_read_engines.append(ro)
+    print(f"[shards] {DB_SHARDS} SQLite shards by {DB_SHARD_BY}")
+SHARD_COUNT = len(shard_engines)
+_shard_pool = ThreadPoolExecutor(max_workers=SHARD_COUNT, thread_name_prefix="shard") if SHARD_COUNT > 1 else None
+SEQ_COL = "seq" if engine.url.get_backend_name().startswith("postgresql") else "rowid"
 SMTP_HOST = os.getenv("SMTP_HOST", "")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 SMTP_USER = os.getenv("SMTP_USER", "cwade1755@gmail.com")
@@ -153,7 +554,38 @@ print(
 )
 ADMIN_CLEAR_PASSWORD = os.getenv("ADMIN_CLEAR_PASSWORD", "start")
 TZ = pytz.timezone("America/Chicago")
-app = FastAPI(title="GCH Timer API")
+scheduler = None
+def _start_scheduler():
+    global scheduler
+    from apscheduler.schedulers.background import BackgroundScheduler
+    scheduler = BackgroundScheduler(timezone=TZ)
+    scheduler.add_job(weekly_rollup_job, "cron", day_of_week="fri", hour=17, minute=00)
+    scheduler.add_job(mail_retry_job, "interval", minutes=int(os.getenv("MAIL_RETRY_MINUTES", "15")))
+    scheduler.start()
+def _deferred_startup():
+    t0 = time.perf_counter()
+    try:
+        _write_subscribers_csv()
+    except Exception as e:
+        print(f"[subscribers.csv] initial write failed: {e}")
+    try:
+        _start_scheduler()
+    except Exception as e:
+        print(f"[scheduler] start failed: {e}")
+    print(f"[startup] deferred tasks done in {(time.perf_counter() - t0) * 1000:.0f} ms")
+    try:
+        for eng in shard_engines:
+            run_online_migrations(eng)
+    except Exception as e:
+        print(f"[schema] online migration failed: {e}")
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    threading.Thread(target=_deferred_startup, name="deferred-startup", daemon=True).start()
+    print(f"[startup] accepting requests {(time.perf_counter() - _BOOT_T0) * 1000:.0f} ms after import")
+    yield
+    if scheduler is not None and scheduler.running:
+        scheduler.shutdown(wait=False)
+app = FastAPI(title="GCH Timer API", lifespan=_lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -168,6 +600,96 @@ app.add_middleware(
     allow_headers=["*"],
     allow_credentials=False,
 )
+@app.middleware("http")
+async def _metrics_middleware(request: Request, call_next):
+    t0 = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        _inc("gch_http_requests_total", (("route", route), ("method", request.method), ("status", str(status_code))))
+        _observe("gch_http_request_duration_seconds", (("route", route), ("method", request.method)),
+                 time.perf_counter() - t0)
+_profiled_paths: set[str] | None = None
+class _ProfileMiddleware:
+    def __init__(self, app):
+        self.app = app
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or b"profile=" not in scope.get("query_string", b""):
+            return await self.app(scope, receive, send)
+        request = Request(scope)
+        if request.query_params.get("profile") != "1":
+            return await self.app(scope, receive, send)
+        global _profiled_paths
+        if _profiled_paths is None:
+            _profiled_paths = {
+                r.path for r in app.routes if getattr(getattr(r, "endpoint", None), "__profiled__", False)
+            }
+        if scope["path"] not in _profiled_paths:
+            return await JSONResponse(
+                {"detail": f"profile=1 is only supported on: {', '.join(sorted(_profiled_paths))}"},
+                status_code=400,
+            )(scope, receive, send)
+        password = (request.query_params.get("password") or "").strip()
+        if not ADMIN_CLEAR_PASSWORD or not secrets.compare_digest(password, ADMIN_CLEAR_PASSWORD):
+            return await JSONResponse({"detail": "Invalid admin password."}, status_code=403)(scope, receive, send)
+        prof = {"db_ms": 0.0, "db_queries": [], "handler_ms": None, "stats": ""}
+        captured = {"status": 500, "bytes": 0}
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                captured["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                captured["bytes"] += len(message.get("body", b""))
+        token = _request_profile.set(prof)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            _request_profile.reset(token)
+        await JSONResponse(_profile_report(request.url.path, captured, prof, (time.perf_counter() - t0) * 1000))(
+            scope, receive, send
+        )
+app.add_middleware(_ProfileMiddleware)
+def _profile_report(path: str, captured: dict, prof: dict, total_ms: float) -> dict:
+    handler_ms = prof["handler_ms"]
+    return {
+        "path": path,
+        "status": captured["status"],
+        "profiled": handler_ms is not None,
+        "total_ms": round(total_ms, 3),
+        "handler_ms": None if handler_ms is None else round(handler_ms, 3),
+        "db_ms": round(prof["db_ms"], 3),
+        "python_ms": None if handler_ms is None else round(handler_ms - prof["db_ms"], 3),
+        "serialize_ms": None if handler_ms is None else round(total_ms - handler_ms, 3),
+        "response_bytes": captured["bytes"],
+        "db_queries": prof["db_queries"],
+        "profile": prof["stats"],
+    }
+def _profiled(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        prof = _request_profile.get()
+        if prof is None:
+            return fn(*args, **kwargs)
+        profiler = cProfile.Profile()
+        t0 = time.perf_counter()
+        try:
+            return profiler.runcall(fn, *args, **kwargs)
+        finally:
+            prof["handler_ms"] = (time.perf_counter() - t0) * 1000
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+            prof["stats"] = out.getvalue()
+    wrapper.__profiled__ = True
+    return wrapper
+@app.get("/metrics", tags=["read"])
+def metrics(token: str = Query(default="")):
+    if METRICS_TOKEN and not secrets.compare_digest(token, METRICS_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return PlainTextResponse(_render_metrics(), media_type="text/plain; version=0.0.4")
 class ClearRequest(BaseModel):
     password: str
 class Event(BaseModel):
@@ -182,6 +704,7 @@ class Event(BaseModel):
     idle_ms: int = 0
     page: str | None = None
     session_id: str
+    event_id: str | None = None
 class SendNowRequest(BaseModel):
     password: str
     recipients: list[str] | None = None
@@ -193,6 +716,12 @@ class SubscribeRequest(BaseModel):
 
 class UnsubscribeRequest(BaseModel):
     email: str
+class BulkSubscribeRequest(BaseModel):
+    password: str
+    subscribers: list[SubscribeRequest] | None = None
+    csv: str | None = None
+    unsubscribe: bool = False
+BULK_CHUNK_ROWS = 500
 EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
 def _norm_email(e: str) -> str:
     return (e or "").strip().lower()
@@ -201,7 +730,152 @@ def _validate_email(e: str) -> str:
     if not EMAIL_RE.match(e):
         raise HTTPException(status_code=400, detail="Invalid email address.")
     return e
-@app.post("/subscribe")
+SSE_POLL_S = float(os.getenv("SSE_POLL_S", "0.5"))
+SSE_DB_POLL_S = float(os.getenv("SSE_DB_POLL_S", "5"))
+SSE_PING_S = float(os.getenv("SSE_PING_S", "15"))
+SYNC_BATCH_ROWS = int(os.getenv("SYNC_BATCH_ROWS", "1000"))
+_ingest_tick = 0
+EVENT_ID_CACHE_SIZE = int(os.getenv("EVENT_ID_CACHE_SIZE", "50000"))
+_recent_event_ids: OrderedDict[str, None] = OrderedDict()
+_recent_event_ids_lock = threading.Lock()
+def _seen_event_id(event_id: str) -> bool:
+    with _recent_event_ids_lock:
+        if event_id in _recent_event_ids:
+            _recent_event_ids.move_to_end(event_id)
+            return True
+        return False
+def _remember_event_id(event_id: str) -> None:
+    with _recent_event_ids_lock:
+        _recent_event_ids[event_id] = None
+        _recent_event_ids.move_to_end(event_id)
+        while len(_recent_event_ids) > EVENT_ID_CACHE_SIZE:
+            _recent_event_ids.popitem(last=False)
+_daily_history: dict[tuple, dict[tuple, int]] = {}
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+def _sync_epoch(conn) -> str:
+    row = conn.exec_driver_sql("SELECT value FROM sync_state WHERE key = 'epoch'").fetchone()
+    if row:
+        return row[0]
+    conn.execute(text("INSERT INTO sync_state (key, value) VALUES ('epoch', :v) ON CONFLICT (key) DO NOTHING"),
+                 {"v": uuid.uuid4().hex[:12]})
+    return conn.exec_driver_sql("SELECT value FROM sync_state WHERE key = 'epoch'").scalar()
+def _current_epoch() -> str:
+    with read_engine.begin() as conn:
+        return _sync_epoch(conn)
+def _daily_generation(conn) -> str:
+    return conn.exec_driver_sql("SELECT value FROM sync_state WHERE key = 'daily_gen'").scalar() or ""
+SEQ_MARK_SQL = text("""
+    SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint AS xmin,
+           pg_snapshot_xmax(pg_current_snapshot())::text::bigint AS xmax,
+           COALESCE(MAX(seq), 0) AS head
+    FROM events
+""").execution_options(query_name="seq_mark")
+SEQ_MARKS_MAX = 4096
+_seq_marks: deque = deque()
+_seq_safe = 0
+_seq_lock = threading.Lock()
+def _shard_head(conn) -> int:
+    if SEQ_COL != "seq":
+        return int(conn.exec_driver_sql(f"SELECT COALESCE(MAX({SEQ_COL}), 0) FROM events").scalar() or 0)
+    global _seq_safe
+    row = conn.execute(SEQ_MARK_SQL).one()
+    with _seq_lock:
+        if row.head > _seq_safe and (not _seq_marks or row.head > _seq_marks[-1][1]):
+            if len(_seq_marks) >= SEQ_MARKS_MAX:
+                _seq_marks.popleft()
+            _seq_marks.append((row.xmax, row.head))
+        while _seq_marks and _seq_marks[0][0] <= row.xmin:
+            _seq_safe = max(_seq_safe, _seq_marks.popleft()[1])
+        return _seq_safe
+def _fmt_cursor(epoch: str, pos: tuple) -> str:
+    return f"{epoch}:{'.'.join(str(p) for p in pos)}"
+def _parse_cursor(cursor: str) -> tuple[str | None, tuple | None]:
+    epoch, _, seq = (cursor or "").strip().partition(":")
+    parts = seq.split(".")
+    if not epoch or not all(p.isdigit() for p in parts):
+        return None, None
+    pos = tuple(int(p) for p in parts)
+    if pos == (0,):
+        pos = (0,) * SHARD_COUNT
+    if len(pos) != SHARD_COUNT:
+        return None, None
+    return epoch, pos
+def _shard_index(session_id: str, ts: str) -> int:
+    if SHARD_COUNT == 1:
+        return 0
+    if DB_SHARD_BY == "day":
+        day = _chicago_day(ts)
+        return datetime.fromisoformat(day).toordinal() % SHARD_COUNT if day else 0
+    return zlib.crc32((session_id or "").encode("utf-8")) % SHARD_COUNT
+def _fan_out(fn, args: list[tuple]) -> list:
+    if _shard_pool is None or len(args) == 1:
+        return [fn(*a) for a in args]
+    futures = [_shard_pool.submit(copy_context().run, fn, *a) for a in args]
+    return [f.result() for f in futures]
+def _merge_partials(parts: list[list[dict]], keys: tuple, sums: tuple = (), mins: tuple = (),
+                    maxs: tuple = ()) -> list[dict]:
+    if len(parts) == 1:
+        return parts[0]
+    out: dict[tuple, dict] = {}
+    for part in parts:
+        for r in part:
+            k = tuple(r[c] for c in keys)
+            cur = out.get(k)
+            if cur is None:
+                out[k] = r
+                continue
+            for c in sums:
+                cur[c] = (cur[c] or 0) + (r[c] or 0)
+            for c in mins:
+                if r[c] is not None and (cur[c] is None or r[c] < cur[c]):
+                    cur[c] = r[c]
+            for c in maxs:
+                if r[c] is not None and (cur[c] is None or r[c] > cur[c]):
+                    cur[c] = r[c]
+    return list(out.values())
+def _clear_events(conn) -> None:
+    global _ingest_tick
+    conn.exec_driver_sql("DELETE FROM sync_state WHERE key = 'daily_backfill'")
+    conn.exec_driver_sql("DELETE FROM events")
+    conn.exec_driver_sql("DELETE FROM daily_totals")
+    for eng in shard_engines[1:]:
+        with eng.begin() as shard:
+            shard.exec_driver_sql("DELETE FROM sync_state WHERE key = 'daily_backfill'")
+            shard.exec_driver_sql("DELETE FROM events")
+            shard.exec_driver_sql("DELETE FROM daily_totals")
+    _ingest_tick += 1
+    _set_sync_state(conn, "epoch", uuid.uuid4().hex[:12])
+def _events_since(since: tuple | None, limit: int = SYNC_BATCH_ROWS) -> tuple[str, tuple, list[dict], tuple, bool]:
+    per_shard = max(1, -(-limit // SHARD_COUNT))
+    sql = text(f"""
+        SELECT {SEQ_COL} AS seq, ts, email, team, complaint_id, source, section, reason,
+               active_ms, idle_ms, page, session_id
+        FROM events
+        WHERE {SEQ_COL} > :since AND {SEQ_COL} <= :head
+        ORDER BY {SEQ_COL}
+        LIMIT :limit
+    """).execution_options(query_name="events_since")
+    def one(i: int, eng) -> tuple[int, list[dict]]:
+        with eng.begin() as conn:
+            head = _shard_head(conn)
+            if since is None:
+                return head, []
+            rows = conn.execute(sql, {"since": since[i], "head": head, "limit": per_shard}).mappings().all()
+        return head, [dict(r) for r in rows]
+    epoch = _current_epoch()
+    parts = _fan_out(one, list(enumerate(shard_read_engines)))
+    head = tuple(h for h, _ in parts)
+    pos = list(since or head)
+    rows, more = [], False
+    for i, (_, part) in enumerate(parts):
+        if part:
+            pos[i] = part[-1]["seq"]
+            more = more or len(part) >= per_shard
+        for r in part:
+            r["seq"] = r["seq"] * SHARD_COUNT + i
+        rows.extend(part)
+    return epoch, head, rows, tuple(pos), more
+@app.post("/subscribe", tags=["write"])
 def subscribe(req: SubscribeRequest):
     email = _validate_email(req.email)
     team = (req.team or "").strip()
@@ -217,7 +891,7 @@ def subscribe(req: SubscribeRequest):
         conn.execute(sql, {"email": email, "team": team, "created_ts": now})
     _write_subscribers_csv() 
     return {"ok": True, "email": email, "team": team, "is_active": True}
-@app.post("/unsubscribe")
+@app.post("/unsubscribe", tags=["write"])
 def unsubscribe(req: UnsubscribeRequest):
     email = _validate_email(req.email)
     sql = text("UPDATE subscribers SET is_active = 0 WHERE email = :email")
@@ -225,7 +899,86 @@ def unsubscribe(req: UnsubscribeRequest):
         conn.execute(sql, {"email": email})
     _write_subscribers_csv()  
     return {"ok": True, "email": email, "is_active": False}
-@app.get("/subscribers")
+def _bulk_rows(req: BulkSubscribeRequest) -> list[tuple[str, str]]:
+    rows = [(s.email, s.team or "") for s in (req.subscribers or [])]
+    if req.csv:
+        reader = csv.reader(io.StringIO(req.csv.strip()))
+        for i, rec in enumerate(reader):
+            if not rec or not any(c.strip() for c in rec):
+                continue
+            if i == 0 and rec[0].strip().lower() == "email":
+                continue
+            rows.append((rec[0], rec[1] if len(rec) > 1 else ""))
+    return rows
+@app.post("/subscribe_bulk", tags=["write"])
+def subscribe_bulk(req: BulkSubscribeRequest):
+    if not ADMIN_CLEAR_PASSWORD:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Bulk subscribe is disabled (ADMIN_CLEAR_PASSWORD not set)."
+        )
+    if not secrets.compare_digest((req.password or "").strip(), ADMIN_CLEAR_PASSWORD):
+        raise HTTPException(status_code=403, detail="Invalid admin password.")
+    results = []
+    valid: dict[str, str] = {}
+    last_row: dict[str, dict] = {}
+    for i, (raw_email, raw_team) in enumerate(_bulk_rows(req)):
+        try:
+            email = _validate_email(raw_email)
+        except HTTPException as e:
+            results.append({"row": i, "email": (raw_email or "").strip(), "ok": False, "error": e.detail})
+            continue
+        team = (raw_team or "").strip()
+        if email in last_row:
+            last_row[email]["superseded_by"] = i
+        valid[email] = team
+        last_row[email] = {"row": i, "email": email, "team": team, "ok": True}
+        results.append(last_row[email])
+    if not results:
+        raise HTTPException(status_code=400, detail="No subscribers provided.")
+    now = datetime.now(TZ).isoformat()
+    items = list(valid.items())
+    applied = 0
+    with engine.begin() as conn:
+        for start in range(0, len(items), BULK_CHUNK_ROWS):
+            chunk = items[start:start + BULK_CHUNK_ROWS]
+            params = {}
+            if req.unsubscribe:
+                for j, (email, _) in enumerate(chunk):
+                    params[f"e{j}"] = email
+                placeholders = ", ".join(f":e{j}" for j in range(len(chunk)))
+                known = {r[0] for r in conn.execute(
+                    text(f"SELECT email FROM subscribers WHERE email IN ({placeholders})"), params
+                )}
+                for email, _ in chunk:
+                    if email not in known:
+                        last_row[email].update(ok=False, error="not subscribed")
+                conn.execute(text(f"UPDATE subscribers SET is_active = 0 WHERE email IN ({placeholders})"), params)
+                applied += len(known)
+                continue
+            applied += len(chunk)
+            values = []
+            for j, (email, team) in enumerate(chunk):
+                params.update({f"e{j}": email, f"t{j}": team, f"c{j}": now})
+                values.append(f"(:e{j}, :t{j}, 1, :c{j})")
+            conn.execute(text(f"""
+                INSERT INTO subscribers (email, team, is_active, created_ts)
+                VALUES {", ".join(values)}
+                ON CONFLICT(email) DO UPDATE SET
+                    team = excluded.team,
+                    is_active = 1
+            """), params)
+    if applied:
+        _write_subscribers_csv()
+    return {
+        "ok": True,
+        "is_active": not req.unsubscribe,
+        "applied": applied,
+        "rejected": sum(1 for r in results if not r["ok"]),
+        "superseded": sum(1 for r in results if "superseded_by" in r),
+        "results": results,
+    }
+@app.get("/subscribers", tags=["read"])
 def list_subscribers(password: str):
     if not secrets.compare_digest((password or "").strip(), ADMIN_CLEAR_PASSWORD):
         raise HTTPException(status_code=403, detail="Invalid admin password.")
@@ -236,81 +989,220 @@ def list_subscribers(password: str):
             ORDER BY created_ts DESC
         """)).mappings().all()
     return [dict(r) for r in rows]
-@app.get("/health")
+@app.get("/health", tags=["read"])
 def health():
     try:
-        with engine.begin() as conn:
-            conn.exec_driver_sql("SELECT 1")
+        for eng in (*shard_engines, *shard_read_engines):
+            with eng.begin() as conn:
+                conn.exec_driver_sql("SELECT 1")
         return {"ok": True}
     except Exception as e:
         return {"ok": False, "error": str(e)}
-@app.get("/")
+@app.get("/", tags=["read"])
 def root():
     return {"ok": True, "message": "GCH Timer API"}
-@app.post("/ingest")
+INGEST_SQL = text("""
+    INSERT INTO events
+    (ts,email,team,complaint_id,source,section,reason,active_ms,idle_ms,page,session_id,event_id)
+    VALUES
+    (:ts,:email,:team,:complaint_id,:source,:section,:reason,:active_ms,:idle_ms,:page,:session_id,:event_id)
+    ON CONFLICT DO NOTHING
+""").execution_options(query_name="ingest")
+COMPLAINT_ID_RE = re.compile(r"^[67]\d{5,11}$")
+INGEST_BULK_MAX_BYTES = int(os.getenv("INGEST_BULK_MAX_BYTES", str(4 * 1024 * 1024)))
+BULK_KEYS = {"s": "session_id", "e": "email", "t": "team", "o": "source", "c": "complaint_id", "x": "section", "p": "page"}
+BULK_TS_MAX_MS = 4102444800000
+BULK_INT_MAX = 2 ** 53
+BULK_REASONS = {
+    "o": "open", "h": "heartbeat", "u": "unload", "v": "visibility", "s": "section_change", "c": "complaint_change",
+}
+def _event_row(ev: dict) -> dict:
+    cid = (ev.get("complaint_id") or "").strip()
+    if cid and not COMPLAINT_ID_RE.match(cid):
+        raise HTTPException(status_code=400, detail="complaint_id must be 6–12 digits starting with 6 or 7")
+    return {
+        "ts": ev["ts"],
+        "email": ev["email"],
+        "team": (ev.get("team") or "").strip(),
+        "complaint_id": cid,
+        "source": (ev.get("source") or "").strip(),
+        "section": (ev.get("section") or "").strip(),
+        "reason": ev["reason"],
+        "active_ms": int(ev["active_ms"]),
+        "idle_ms": int(ev.get("idle_ms") or 0),
+        "page": (ev.get("page") or "").strip(),
+        "session_id": ev["session_id"],
+        "event_id": (ev.get("event_id") or "").strip()[:64] or None,
+    }
+def _write_events(i: int, rows: list[dict]) -> tuple[list[dict], dict]:
+    inserted = []
+    with shard_engines[i].begin() as conn:
+        if SEQ_COL == "seq":
+            conn.exec_driver_sql("SELECT pg_current_xact_id()")
+        for row in rows:
+            if conn.execute(INGEST_SQL, row).rowcount:
+                inserted.append(row)
+        agg = _daily_rollup(tuple(r[c] for c in DAILY_SOURCE_COLUMNS) for r in inserted)
+        _upsert_daily(conn, agg)
+    return inserted, agg
+def _store_events(rows: list[dict]) -> int:
+    fresh = []
+    for row in rows:
+        if row["event_id"] and _seen_event_id(row["event_id"]):
+            _inc("gch_ingest_duplicates_total", (("where", "cache"),))
+            continue
+        fresh.append(row)
+    if not fresh:
+        return 0
+    by_shard: dict[int, list[dict]] = {}
+    for row in fresh:
+        by_shard.setdefault(_shard_index(row["session_id"], row["ts"]), []).append(row)
+    inserted, agg = [], {}
+    for shard_inserted, shard_agg in _fan_out(_write_events, list(by_shard.items())):
+        inserted += shard_inserted
+        agg.update(shard_agg)
+    for row in fresh:
+        if row["event_id"]:
+            _remember_event_id(row["event_id"])
+    if len(inserted) < len(fresh):
+        _inc("gch_ingest_duplicates_total", (("where", "db"),), len(fresh) - len(inserted))
+    if inserted:
+        global _ingest_tick
+        _ingest_tick += 1
+        if any(key[0] < datetime.now(TZ).date().isoformat() for key in agg):
+            _bump_daily_gen()
+        _inc("gch_ingest_rows_total", (), len(inserted))
+    return len(inserted)
+def _fmt_ms_ts(ms: int) -> str:
+    return datetime.fromtimestamp(ms // 1000, pytz.utc).strftime("%Y-%m-%dT%H:%M:%S.") + f"{ms % 1000:03d}Z"
+def _decode_bulk(body: bytes) -> list[dict]:
+    if body[:2] == b"\x1f\x8b":
+        d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = d.decompress(body, INGEST_BULK_MAX_BYTES)
+        except zlib.error:
+            raise HTTPException(status_code=400, detail="Invalid gzip body.")
+        if d.unconsumed_tail:
+            raise HTTPException(status_code=413, detail="Batch too large.")
+    ctx: dict = {}
+    rows = []
+    for n, line in enumerate(body.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"line {n}: invalid JSON")
+        if isinstance(item, dict):
+            for k, v in item.items():
+                if k in BULK_KEYS:
+                    if v is not None and not isinstance(v, str):
+                        raise HTTPException(status_code=400, detail=f"line {n}: '{k}' must be a string")
+                    ctx[BULK_KEYS[k]] = v or ""
+            continue
+        if (
+            not isinstance(item, list) or len(item) not in (4, 5)
+            or not all(type(v) is int and 0 <= v < BULK_INT_MAX for v in (item[0], item[2], item[3]))
+            or not isinstance(item[1], str)
+            or (len(item) == 5 and item[4] is not None and not isinstance(item[4], str))
+        ):
+            raise HTTPException(status_code=400, detail=f"line {n}: expected [ts_ms, reason, active_ms, idle_ms, event_id?]")
+        if item[0] >= BULK_TS_MAX_MS:
+            raise HTTPException(status_code=400, detail=f"line {n}: ts_ms out of range")
+        if not ctx.get("session_id") or not ctx.get("email"):
+            raise HTTPException(status_code=400, detail=f"line {n}: delta before session header")
+        rows.append(_event_row({
+            **ctx,
+            "ts": _fmt_ms_ts(item[0]),
+            "reason": BULK_REASONS.get(item[1], item[1]),
+            "active_ms": item[2],
+            "idle_ms": item[3],
+            "event_id": item[4] if len(item) == 5 else None,
+        }))
+    return rows
+@app.post("/ingest", tags=["write"])
 def ingest(ev: Event):
-    sql = text("""
-        INSERT INTO events
-        (ts,email,team,complaint_id,source,section,reason,active_ms,idle_ms,page,session_id)
-        VALUES
-        (:ts,:email,:team,:complaint_id,:source,:section,:reason,:active_ms,:idle_ms,:page,:session_id)
-    """)
-    with engine.begin() as conn:
-        cid = (ev.complaint_id or "").strip()
-        if cid and not re.match(r"^[67]\d{5,11}$", cid):
-            raise HTTPException(status_code=400, detail="complaint_id must be 6–12 digits starting with 6 or 7")
-        conn.execute(sql, {
-            "ts": ev.ts,
-            "email": ev.email,
-            "team": (ev.team or "").strip(),
-            "complaint_id": cid,
-            "source": (ev.source or "").strip(),
-            "section": (ev.section or "").strip(),
-            "reason": ev.reason,
-            "active_ms": int(ev.active_ms),
-            "idle_ms": int(ev.idle_ms or 0),
-            "page": (ev.page or "").strip(),
-            "session_id": ev.session_id,
-        })
-    return {"ok": True}
-@app.get("/sessions")
+    if _store_events([_event_row(ev.model_dump())]):
+        return {"ok": True}
+    return {"ok": True, "duplicate": True}
+@app.post("/ingest_bulk", tags=["write"])
+async def ingest_bulk(request: Request):
+    if int(request.headers.get("content-length") or 0) > INGEST_BULK_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Batch too large.")
+    body = await request.body()
+    if len(body) > INGEST_BULK_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Batch too large.")
+    rows = await run_in_threadpool(_decode_bulk, body)
+    accepted = await run_in_threadpool(_store_events, rows)
+    return {"ok": True, "accepted": accepted, "duplicates": len(rows) - accepted}
+@app.get("/sessions", tags=["read"])
+@_profiled
 def sessions():
-    sql = """
+    having = "HAVING (COALESCE(SUM(active_ms),0) + COALESCE(SUM(idle_ms),0)) >= 1000" if SHARD_COUNT == 1 else ""
+    sql = text(f"""
       SELECT
         session_id, email, team, complaint_id, source,
         MIN(ts) AS start_ts,
         COALESCE(SUM(active_ms),0) AS active_ms,
-        COALESCE(SUM(idle_ms),0)   AS idle_ms
+        COALESCE(SUM(idle_ms),0)   AS idle_ms,
+        MAX(ts) AS last_ts
       FROM events
       GROUP BY session_id, email, team, complaint_id, source
-      HAVING (COALESCE(SUM(active_ms),0) + COALESCE(SUM(idle_ms),0)) >= 1000
-      ORDER BY MAX(ts) DESC
-    """
+      {having}
+    """).execution_options(query_name="sessions")
+    def one(i: int, eng) -> list[dict]:
+        with eng.begin() as conn:
+            return [dict(r) for r in conn.execute(sql).mappings().all()]
     try:
-        with engine.begin() as conn:
-            rows = conn.exec_driver_sql(sql).mappings().all()
-        return [dict(r) for r in rows]
+        parts = _fan_out(one, list(enumerate(shard_read_engines)))
+        rows = _merge_partials(parts, ("session_id", "email", "team", "complaint_id", "source"),
+                               sums=("active_ms", "idle_ms"), mins=("start_ts",), maxs=("last_ts",))
+        rows = [r for r in rows if r["active_ms"] + r["idle_ms"] >= 1000]
+        rows.sort(key=lambda r: r["last_ts"] or "", reverse=True)
+        for r in rows:
+            del r["last_ts"]
+        return rows
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-@app.get("/sessions_by_section")
+@app.get("/sessions_by_section", tags=["read"])
+@_profiled
 def sessions_by_section():
-    sql = """
+    sql = text("""
       SELECT email, team, complaint_id, source, section,
-        COALESCE(SUM(active_ms),0) AS active_ms
-      FROM events
-      WHERE TRIM(COALESCE(section,'')) <> ''
+        COALESCE(SUM(active_ms),0) AS active_ms,
+        MAX(last_ts) AS last_ts
+      FROM daily_totals
+      WHERE section <> ''
       GROUP BY email, team, complaint_id, source, section
-      ORDER BY MAX(ts) DESC
-    """
-    with engine.begin() as conn:
-        rows = conn.exec_driver_sql(sql).mappings().all()
-    return [dict(r) for r in rows]
-@app.get("/active_subscribers")
+    """).execution_options(query_name="sessions_by_section")
+    keys = ("email", "team", "complaint_id", "source", "section")
+    def one(i: int, eng) -> list[dict]:
+        with eng.begin() as conn:
+            if not _daily_backfill_pending(conn):
+                return [dict(r) for r in conn.execute(sql).mappings().all()]
+            out: dict[tuple, dict] = {}
+            for r in _live_daily_totals(conn):
+                if not r["section"]:
+                    continue
+                k = tuple(r[c] for c in keys)
+                cur = out.setdefault(k, {**dict(zip(keys, k)), "active_ms": 0, "last_ts": None})
+                cur["active_ms"] += r["active_ms"]
+                if r["last_ts"] and (cur["last_ts"] is None or r["last_ts"] > cur["last_ts"]):
+                    cur["last_ts"] = r["last_ts"]
+            return list(out.values())
+    parts = _fan_out(one, list(enumerate(shard_read_engines)))
+    rows = _merge_partials(parts, keys, sums=("active_ms",), maxs=("last_ts",))
+    rows.sort(key=lambda r: r["last_ts"] or "", reverse=True)
+    for r in rows:
+        del r["last_ts"]
+    return rows
+@app.get("/active_subscribers", tags=["read"])
 def active_subscribers(token: str = Query(default="")):
     if not SUBSCRIBERS_TOKEN or not secrets.compare_digest(token, SUBSCRIBERS_TOKEN):
         raise HTTPException(status_code=403, detail="Forbidden")
     return _active_subscriber_emails()
-@app.get("/events")
+@app.get("/events", tags=["read"])
+@_profiled
 def events_for_complaint(complaint_id: str):
     sql = text("""
       SELECT ts, email, team, complaint_id, source, section, reason, active_ms, idle_ms, page, session_id
@@ -318,45 +1210,121 @@ def events_for_complaint(complaint_id: str):
       WHERE complaint_id = :cid
       ORDER BY ts ASC
     """)
-    with engine.begin() as conn:
-        rows = conn.execute(sql, {"cid": complaint_id}).mappings().all()
-    return [dict(r) for r in rows]
-@app.get("/sections_by_weekday")
+    def one(i: int, eng) -> list[dict]:
+        with eng.begin() as conn:
+            return [dict(r) for r in conn.execute(sql, {"cid": complaint_id}).mappings().all()]
+    parts = _fan_out(one, list(enumerate(shard_read_engines)))
+    if len(parts) == 1:
+        return parts[0]
+    return sorted((r for p in parts for r in p), key=lambda r: r["ts"] or "")
+def _weekday_totals(conn, today: str, past: bool) -> dict[tuple, int]:
+    if _daily_backfill_pending(conn):
+        rows = [(r["day"], r["complaint_id"], r["source"], r["section"], r["active_ms"])
+                for r in _live_daily_totals(conn)
+                if r["day"] and r["section"] and (r["day"] < today) == past]
+    else:
+        rows = conn.execute(text(f"""
+            SELECT day, complaint_id, source, section, COALESCE(SUM(active_ms),0) AS active_ms
+            FROM daily_totals
+            WHERE day <> '' AND section <> '' AND day {'<' if past else '>='} :today
+            GROUP BY day, complaint_id, source, section
+        """).execution_options(query_name="sections_by_weekday"), {"today": today}).fetchall()
+    out: dict[tuple, int] = {}
+    for day, complaint_id, source, section, active_ms in rows:
+        key = (complaint_id, source, section, WEEKDAYS[datetime.fromisoformat(day).weekday()])
+        out[key] = out.get(key, 0) + int(active_ms)
+    return out
+@app.get("/sections_by_weekday", tags=["read"])
+@_profiled
 def sections_by_weekday():
-    with engine.begin() as conn:
-        df = pd.read_sql_query(
-            "SELECT ts, complaint_id, source, section, active_ms FROM events WHERE TRIM(COALESCE(section,'')) <> ''",
-            conn
-        )
-    if df.empty:
-        return []
-    t = pd.to_datetime(df["ts"], errors="coerce", utc=True)
-    df["weekday"] = t.dt.tz_convert("America/Chicago").dt.day_name()
-    out = (
-        df.groupby(["complaint_id","source","section","weekday"], as_index=False)["active_ms"]
-          .sum()
-          .sort_values(["weekday","complaint_id","source","section"])
+    today = datetime.now(TZ).date().isoformat()
+    with read_engine.begin() as conn:
+        history = _daily_history.get((_sync_epoch(conn), today, _daily_generation(conn)))
+    def one(i: int, eng) -> tuple[tuple | None, dict | None, dict, bool]:
+        key, past, pending = None, None, False
+        with eng.begin() as conn:
+            if history is None:
+                if _is_postgres(conn):
+                    conn.exec_driver_sql("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                if i == 0:
+                    key = (_sync_epoch(conn), today, _daily_generation(conn))
+                pending = _daily_backfill_pending(conn)
+                past = _weekday_totals(conn, today, True)
+            return key, past, _weekday_totals(conn, today, False), pending
+    parts = _fan_out(one, list(enumerate(shard_read_engines)))
+    if history is None:
+        history = {}
+        for _, past, _, _ in parts:
+            for k, v in past.items():
+                history[k] = history.get(k, 0) + v
+        if not any(pending for _, _, _, pending in parts):
+            _daily_history.clear()
+            _daily_history[parts[0][0]] = history
+    totals = dict(history)
+    for _, _, current, _ in parts:
+        for k, v in current.items():
+            totals[k] = totals.get(k, 0) + v
+    return [
+        {"complaint_id": cid, "source": source, "section": section, "weekday": weekday, "active_ms": ms}
+        for (cid, source, section, weekday), ms in sorted(totals.items(), key=lambda kv: (kv[0][3],) + kv[0][:3])
+    ]
+@app.get("/events_since", tags=["read"])
+def events_since(since: str = Query(default=""), limit: int = Query(default=SYNC_BATCH_ROWS, ge=1, le=50000)):
+    epoch, pos = _parse_cursor(since)
+    cur_epoch = _current_epoch()
+    reset = epoch != cur_epoch
+    _, head, rows, last, more = _events_since((0,) * SHARD_COUNT if reset else pos, limit)
+    return {
+        "reset": reset,
+        "cursor": _fmt_cursor(cur_epoch, last),
+        "head": _fmt_cursor(cur_epoch, head),
+        "more": more,
+        "rows": rows,
+    }
+@app.get("/stream", tags=["read"])
+async def stream(request: Request, since: str = Query(default="")):
+    epoch, pos = _parse_cursor(request.headers.get("last-event-id") or since)
+    async def events():
+        nonlocal epoch, pos
+        seen_tick, last_db, last_sent = None, 0.0, time.monotonic()
+        while not await request.is_disconnected():
+            now = time.monotonic()
+            if seen_tick != _ingest_tick or now - last_db >= SSE_DB_POLL_S:
+                seen_tick, last_db = _ingest_tick, now
+                cur_epoch, head, rows, last, more = await run_in_threadpool(_events_since, pos)
+                if epoch is None:
+                    epoch, pos = cur_epoch, head
+                    yield f"event: hello\nid: {_fmt_cursor(epoch, pos)}\ndata: {{}}\n\n"
+                elif cur_epoch != epoch:
+                    yield f"event: reset\ndata: {json.dumps({'cursor': _fmt_cursor(cur_epoch, head)})}\n\n"
+                    return
+                elif rows:
+                    pos = last
+                    yield (f"event: delta\nid: {_fmt_cursor(epoch, pos)}\n"
+                           f"data: {json.dumps({'rows': rows}, separators=(',', ':'))}\n\n")
+                    last_sent = now
+                    if more:
+                        seen_tick = None
+                        continue
+            if now - last_sent >= SSE_PING_S:
+                yield ": ping\n\n"
+                last_sent = now
+            await asyncio.sleep(SSE_POLL_S)
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    return out.to_dict(orient="records")
-@app.get("/export.xlsx")
+@app.get("/export.xlsx", tags=["read"])
+@_profiled
 def export_xlsx():
-    with engine.begin() as conn:
-        df = pd.read_sql_query("SELECT * FROM events", conn)
-    out = io.BytesIO()
-    with pd.ExcelWriter(out, engine="xlsxwriter") as w:
-        df.to_excel(w, index=False, sheet_name="events")
-        (df.groupby(["email","complaint_id"], as_index=False)[["active_ms","idle_ms"]]
-           .sum().to_excel(w, index=False, sheet_name="by_complaint"))
-        (df[df["section"].astype(str) != ""]
-           .groupby(["complaint_id","section"], as_index=False)["active_ms"].sum()
-           .to_excel(w, index=False, sheet_name="by_section"))
-    out.seek(0)
+    out = io.BytesIO(_export_bytes())
     return StreamingResponse(
         out,
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         headers={"Content-Disposition": 'attachment; filename="export.xlsx"'}
     )
-@app.post("/clear")
+@app.post("/clear", tags=["write"])
 def clear_events(req: ClearRequest):
     if not ADMIN_CLEAR_PASSWORD:
         raise HTTPException(
@@ -369,9 +1337,9 @@ def clear_events(req: ClearRequest):
             detail="Invalid admin password."
         )
     with engine.begin() as conn:
-        conn.exec_driver_sql("DELETE FROM events")
+        _clear_events(conn)
     return {"ok": True, "cleared": True}
-@app.post("/send_now")
+@app.post("/send_now", tags=["write"])
 def send_now(req: SendNowRequest):
     if not ADMIN_CLEAR_PASSWORD:
         raise HTTPException(
@@ -384,81 +1352,355 @@ def send_now(req: SendNowRequest):
         recipients = req.recipients or [SMTP_TO]
         if not recipients:
             raise HTTPException(status_code=400, detail="No recipients configured/provided.")
-        xlsx = _export_bytes()
+        xlsx = _export_bytes(primary=req.clear_after)
         now = datetime.now(TZ).strftime("%Y-%m-%d %H:%M")
         prefix = (req.subject_prefix or "GCH Export")
         subject = f"{prefix} – {now}"
-        _send_email(xlsx, subject, recipients)
+        result = _send_email(xlsx, subject, recipients)
         if req.clear_after:
             with engine.begin() as conn:
-                conn.exec_driver_sql("DELETE FROM events")
-        return {"ok": True, "sent_to": recipients, "cleared": bool(req.clear_after)}
+                _clear_events(conn)
+        return {
+            "ok": True,
+            "sent_to": result["sent"],
+            "failed": result["failed"],
+            "cleared": bool(req.clear_after),
+        }
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-def _export_bytes() -> bytes:
-    with engine.begin() as conn:
-        df = pd.read_sql_query("SELECT * FROM events", conn)
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "50000"))
+def _daily_summaries(conn) -> tuple["pd.DataFrame", "pd.DataFrame"]:
+    import pandas as pd
+    if _daily_backfill_pending(conn):
+        df = pd.DataFrame(_live_daily_totals(conn), columns=[*DAILY_KEY, "active_ms", "idle_ms", "last_ts"])
+        by_complaint = df.groupby(["team", "email", "complaint_id"], as_index=False)[["active_ms", "idle_ms"]].sum()
+        by_section = (df[df["section"] != ""]
+                      .groupby(["team", "complaint_id", "section"], as_index=False)["active_ms"].sum())
+        return by_complaint, by_section
+    by_complaint = pd.read_sql_query(text("""
+        SELECT team, email, complaint_id,
+          COALESCE(SUM(active_ms),0) AS active_ms, COALESCE(SUM(idle_ms),0) AS idle_ms
+        FROM daily_totals
+        GROUP BY team, email, complaint_id
+    """).execution_options(query_name="export_by_complaint"), conn)
+    by_section = pd.read_sql_query(text("""
+        SELECT team, complaint_id, section, COALESCE(SUM(active_ms),0) AS active_ms
+        FROM daily_totals
+        WHERE section <> ''
+        GROUP BY team, complaint_id, section
+    """).execution_options(query_name="export_by_section"), conn)
+    return by_complaint, by_section
+def _workbook_bytes(df: "pd.DataFrame", summaries: tuple, kind: str = "full", team: str | None = None) -> bytes:
+    import pandas as pd
+    t0 = time.perf_counter()
+    by_complaint, by_section = summaries
+    if team is not None:
+        by_complaint = by_complaint[by_complaint["team"] == team]
+        by_section = by_section[by_section["team"] == team]
     out = io.BytesIO()
     with pd.ExcelWriter(out, engine="xlsxwriter") as w:
         df.to_excel(w, index=False, sheet_name="events")
-        (df.groupby(["email","complaint_id"], as_index=False)[["active_ms","idle_ms"]]
+        (by_complaint.groupby(["email","complaint_id"], as_index=False)[["active_ms","idle_ms"]]
            .sum().to_excel(w, index=False, sheet_name="by_complaint"))
-        (df[df["section"].astype(str) != ""]
-           .groupby(["complaint_id","section"], as_index=False)["active_ms"].sum()
+        (by_section.groupby(["complaint_id","section"], as_index=False)["active_ms"].sum()
            .to_excel(w, index=False, sheet_name="by_section"))
-    out.seek(0)
-    return out.read()
-from python_http_client.exceptions import HTTPError as SGHTTPError
-def _send_email(xlsx_bytes: bytes, subject: str, recipients: list[str]):
+    data = out.getvalue()
+    _observe("gch_export_build_seconds", (("kind", kind),), time.perf_counter() - t0)
+    _observe("gch_export_bytes", (("kind", kind),), len(data), BYTES_BUCKETS)
+    return data
+def _export_bytes(primary: bool = False) -> bytes:
+    import pandas as pd
+    frames, summaries = [], []
+    for eng in (shard_engines if primary else shard_read_engines):
+        with eng.begin() as conn:
+            frames.append(pd.read_sql_query("SELECT * FROM events", conn))
+            summaries.append(_daily_summaries(conn))
+    df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    return _workbook_bytes(df, tuple(pd.concat(p, ignore_index=True) for p in zip(*summaries)))
+def _export_bytes_by_team(teams: set[str], include_all: bool = False, primary: bool = False) -> dict[str, bytes]:
+    import pandas as pd
+    parts: dict[str, list[pd.DataFrame]] = {t: [] for t in teams}
+    full: list[pd.DataFrame] = []
+    columns = None
+    shard_summaries = []
+    for eng in (shard_engines if primary else shard_read_engines):
+        with eng.begin() as conn:
+            for chunk in pd.read_sql_query("SELECT * FROM events", conn, chunksize=EXPORT_CHUNK_ROWS):
+                columns = chunk.columns
+                if include_all:
+                    full.append(chunk)
+                for team, part in chunk.groupby(chunk["team"].fillna("").str.strip(), sort=False):
+                    if team in parts:
+                        parts[team].append(part)
+            shard_summaries.append(_daily_summaries(conn))
+    summaries = tuple(pd.concat(p, ignore_index=True) for p in zip(*shard_summaries))
+    def _concat(frames: list[pd.DataFrame]) -> pd.DataFrame:
+        if frames:
+            return pd.concat(frames, ignore_index=True)
+        return pd.DataFrame(columns=columns if columns is not None else EVENT_COLUMNS)
+    out = {team: _workbook_bytes(_concat(frames), summaries, "team", team) for team, frames in parts.items()}
+    if include_all:
+        out[""] = _workbook_bytes(_concat(full), summaries)
+    return out
+def _active_subscribers_by_team() -> dict[str, list[str]]:
+    with engine.begin() as conn:
+        rows = conn.execute(text("""
+            SELECT email, team
+            FROM subscribers
+            WHERE is_active = 1
+        """)).fetchall()
+    by_team: dict[str, list[str]] = {}
+    for email, team in rows:
+        by_team.setdefault((team or "").strip(), []).append(email)
+    return by_team
+def _team_filename(team: str) -> str:
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", team).strip("_")
+    return f"export_{slug}.xlsx" if slug else "export.xlsx"
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+MAIL_WORKERS = int(os.getenv("MAIL_WORKERS", "4"))
+MAIL_RATE_PER_SEC = float(os.getenv("MAIL_RATE_PER_SEC", "5"))
+MAIL_RETRIES = int(os.getenv("MAIL_RETRIES", "3"))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "8"))
+MAIL_BACKOFF_S = float(os.getenv("MAIL_BACKOFF_S", "2"))
+MAIL_CLAIM_STALE_S = float(os.getenv("MAIL_CLAIM_STALE_S", "3600"))
+MAIL_OUTBOX_KEEP_DAYS = int(os.getenv("MAIL_OUTBOX_KEEP_DAYS", "30"))
+class _RateLimiter:
+    def __init__(self, rate_per_sec: float):
+        self.interval = 1.0 / rate_per_sec if rate_per_sec > 0 else 0.0
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+    def acquire(self) -> None:
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+_mail_limiter = _RateLimiter(MAIL_RATE_PER_SEC)
+_sg_client = None
+_sg_client_key = None
+_sg_client_lock = threading.Lock()
+def _sendgrid_client():
+    global _sg_client, _sg_client_key
     api_key = (os.getenv("SENDGRID_API_KEY") or "").strip()
     if not api_key:
         raise RuntimeError("SENDGRID_API_KEY not set (or empty).")
     sendgrid_host = (os.getenv("SENDGRID_HOST") or "https://api.sendgrid.com").strip()
     from sendgrid import SendGridAPIClient
-    from sendgrid.helpers.mail import (
-        Mail, Attachment, FileContent, FileName, FileType, Disposition, Email
-    )
-    import base64
+    with _sg_client_lock:
+        if _sg_client is None or _sg_client_key != (api_key, sendgrid_host):
+            _sg_client = SendGridAPIClient(api_key, host=sendgrid_host)
+            _sg_client_key = (api_key, sendgrid_host)
+        return _sg_client, sendgrid_host
+def _enqueue_mail(recipients: list[str], subject: str, xlsx_bytes: bytes,
+                  filename: str = "export.xlsx") -> list[str]:
+    now = datetime.now(TZ).isoformat()
+    claimed = datetime.now(pytz.utc).isoformat()
+    attachment_id = uuid.uuid4().hex
+    rows = [
+        {"id": uuid.uuid4().hex, "recipient": r, "subject": subject,
+         "attachment_id": attachment_id, "created_ts": now, "claimed_ts": claimed}
+        for r in dict.fromkeys(_norm_email(r) for r in recipients) if r
+    ]
+    if not rows:
+        return []
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO mail_attachments (id, filename, content_b64, created_ts)
+            VALUES (:id, :filename, :content_b64, :created_ts)
+        """), {
+            "id": attachment_id,
+            "filename": filename,
+            "content_b64": base64.b64encode(xlsx_bytes).decode("utf-8"),
+            "created_ts": now,
+        })
+        conn.execute(text("""
+            INSERT INTO mail_outbox (id, recipient, subject, attachment_id, status, attempts, created_ts, claimed_ts)
+            VALUES (:id, :recipient, :subject, :attachment_id, 'pending', 0, :created_ts, :claimed_ts)
+        """), rows)
+    return [r["id"] for r in rows]
+def _mail_retryable(e: Exception) -> bool:
+    from python_http_client.exceptions import HTTPError as SGHTTPError
+    if isinstance(e, SGHTTPError):
+        code = getattr(e, "status_code", 0) or 0
+        return code == 429 or code >= 500
+    return isinstance(e, OSError)
+def _deliver_one(row: dict, attachment: dict) -> tuple[bool, str]:
+    from python_http_client.exceptions import HTTPError as SGHTTPError
+    from sendgrid.helpers.mail import Attachment, Disposition, Email, FileContent, FileName, FileType, Mail
     from_email = (SMTP_FROM or "").strip()
     if not from_email:
         raise RuntimeError("SMTP_FROM missing/empty.")
+    sg, sendgrid_host = _sendgrid_client()
     message = Mail(
         from_email=Email(from_email, SMTP_FROM_NAME),
-        to_emails=recipients,
-        subject=subject,
+        to_emails=[row["recipient"]],
+        subject=row["subject"],
         html_content="Weekly GCH timer export attached."
     )
-    encoded = base64.b64encode(xlsx_bytes).decode("utf-8")
     message.attachment = Attachment(
-        FileContent(encoded),
-        FileName("export.xlsx"),
-        FileType("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+        FileContent(attachment["content_b64"]),
+        FileName(attachment["filename"]),
+        FileType(XLSX_MIME),
         Disposition("attachment"),
     )
-    sg = SendGridAPIClient(api_key, host=sendgrid_host)
+    attempts = int(row["attempts"] or 0)
+    error = ""
+    for i in range(min(MAIL_RETRIES, MAIL_MAX_ATTEMPTS - attempts)):
+        if i:
+            time.sleep(MAIL_BACKOFF_S * (2 ** (i - 1)))
+        _mail_limiter.acquire()
+        attempts += 1
+        try:
+            resp = sg.send(message)
+            if resp.status_code in (200, 202):
+                error = ""
+                break
+            error = f"SendGrid failed: {resp.status_code} body={resp.body}"
+        except SGHTTPError as e:
+            error = (
+                f"SendGrid SGHTTPError {getattr(e, 'status_code', None)} "
+                f"host={sendgrid_host} from={from_email} to={row['recipient']} "
+                f"body={getattr(e, 'body', None)}"
+            )
+            if not _mail_retryable(e):
+                attempts = MAIL_MAX_ATTEMPTS
+                break
+        except OSError as e:
+            error = f"SendGrid connection error host={sendgrid_host}: {e}"
+    else:
+        if not error:
+            error = "max attempts reached"
+    ok = not error
+    _finish_mail(row["id"], ok, attempts, error)
+    return ok, error
+def _finish_mail(outbox_id: str, ok: bool, attempts: int, error: str) -> None:
+    with engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE mail_outbox
+            SET status = :status, attempts = :attempts, last_error = :err, sent_ts = :sent_ts
+            WHERE id = :id
+        """), {
+            "id": outbox_id,
+            "status": "sent" if ok else "failed",
+            "attempts": attempts,
+            "err": error or None,
+            "sent_ts": datetime.now(TZ).isoformat() if ok else None,
+        })
+MAIL_CLAIM_SQL = text("""
+    UPDATE mail_outbox SET status = 'sending', claimed_ts = :now
+    WHERE id = :id AND status = :status AND COALESCE(claimed_ts, '') = :claimed_ts
+""")
+def _prune_mail(conn) -> None:
+    conn.execute(text("""
+        DELETE FROM mail_attachments
+        WHERE NOT EXISTS (
+            SELECT 1 FROM mail_outbox o
+            WHERE o.attachment_id = mail_attachments.id AND o.status <> 'sent' AND o.attempts < :max_attempts
+        )
+    """), {"max_attempts": MAIL_MAX_ATTEMPTS})
+    conn.execute(text("""
+        DELETE FROM mail_outbox
+        WHERE (status = 'sent' OR attempts >= :max_attempts) AND created_ts < :cutoff
+    """), {
+        "max_attempts": MAIL_MAX_ATTEMPTS,
+        "cutoff": (datetime.now(TZ) - timedelta(days=MAIL_OUTBOX_KEEP_DAYS)).isoformat(),
+    })
+def _deliver_outbox(ids: list[str] | None = None) -> dict:
+    sql = """
+        SELECT o.id, o.recipient, o.subject, o.attachment_id, o.attempts, o.status,
+               COALESCE(o.claimed_ts, '') AS claimed_ts
+        FROM mail_outbox o
+        WHERE o.status <> 'sent' AND o.attempts < :max_attempts
+    """
+    now = datetime.now(pytz.utc)
+    params = {"max_attempts": MAIL_MAX_ATTEMPTS}
+    if ids is not None:
+        if not ids:
+            return {"sent": [], "failed": []}
+        sql += f" AND o.id IN ({', '.join(f':i{j}' for j in range(len(ids)))}) AND o.status <> 'sending'"
+        params.update({f"i{j}": i for j, i in enumerate(ids)})
+    else:
+        sql += " AND (o.status = 'failed' OR COALESCE(o.claimed_ts, '') < :stale)"
+        params["stale"] = (now - timedelta(seconds=MAIL_CLAIM_STALE_S)).isoformat()
+    with engine.begin() as conn:
+        candidates = [dict(r) for r in conn.execute(text(sql), params).mappings().all()]
+        rows = [
+            r for r in candidates
+            if conn.execute(MAIL_CLAIM_SQL, {**r, "now": now.isoformat()}).rowcount
+        ]
+        att_ids = sorted({r["attachment_id"] for r in rows})
+        attachments = {}
+        if att_ids:
+            att_rows = conn.execute(text(
+                f"SELECT id, filename, content_b64 FROM mail_attachments "
+                f"WHERE id IN ({', '.join(f':a{j}' for j in range(len(att_ids)))})"
+            ), {f"a{j}": a for j, a in enumerate(att_ids)}).mappings().all()
+            attachments = {a["id"]: dict(a) for a in att_rows}
+    sent, failed = [], []
+    if not rows:
+        return {"sent": sent, "failed": failed}
+    with ThreadPoolExecutor(max_workers=max(1, MAIL_WORKERS)) as pool:
+        futures = {pool.submit(_deliver_one, r, attachments[r["attachment_id"]]): r for r in rows}
+        for fut in as_completed(futures):
+            r = futures[fut]
+            try:
+                ok, error = fut.result()
+            except Exception as e:
+                ok, error = False, str(e)
+                _finish_mail(r["id"], False, int(r["attempts"] or 0) + 1, error)
+            _inc("gch_mail_deliveries_total", (("outcome", "sent" if ok else "failed"),))
+            if ok:
+                sent.append(r["recipient"])
+            else:
+                failed.append({"email": r["recipient"], "error": error})
+    return {"sent": sent, "failed": failed}
+def _send_email(xlsx_bytes: bytes, subject: str, recipients: list[str],
+                filename: str = "export.xlsx") -> dict:
+    ids = _enqueue_mail(recipients, subject, xlsx_bytes, filename)
+    result = _deliver_outbox(ids)
+    if ids and not result["sent"]:
+        raise RuntimeError("; ".join(f["error"] for f in result["failed"]) or "No recipients delivered.")
+    return result
+def mail_retry_job():
     try:
-        resp = sg.send(message)
-        if resp.status_code not in (200, 202):
-            raise RuntimeError(f"SendGrid failed: {resp.status_code} body={resp.body}")
-    except SGHTTPError as e:
-        raise RuntimeError(
-            f"SendGrid SGHTTPError {getattr(e, 'status_code', None)} "
-            f"host={sendgrid_host} from={from_email} to={recipients} "
-            f"body={getattr(e, 'body', None)}"
-        ) from e
+        result = _deliver_outbox()
+        if result["sent"] or result["failed"]:
+            print(f"[mail] retried outbox sent={len(result['sent'])} failed={len(result['failed'])}")
+        with engine.begin() as conn:
+            _prune_mail(conn)
+        _inc("gch_scheduler_jobs_total", (("job", "mail_retry"), ("outcome", "ok")))
+    except Exception as e:
+        _inc("gch_scheduler_jobs_total", (("job", "mail_retry"), ("outcome", "error")))
+        print(f"[mail] retry ERROR: {e}")
 def weekly_rollup_job():
     try:
-        recipients = [SMTP_TO]
-        xlsx = _export_bytes()
+        by_team = _active_subscribers_by_team()
+        by_team.setdefault("", [])
+        if SMTP_TO and SMTP_TO not in by_team[""]:
+            by_team[""].append(SMTP_TO)
+        teams = {t for t in by_team if t and by_team[t]}
+        workbooks = _export_bytes_by_team(teams, include_all=bool(by_team[""]), primary=True)
         now = datetime.now(TZ).strftime("%Y-%m-%d")
-        _send_email(xlsx, f"GCH/CW Weekly Data Export – {now}", recipients)
+        ids = []
+        for team, xlsx in workbooks.items():
+            label = f"{team} " if team else ""
+            ids += _enqueue_mail(by_team[team], f"GCH/CW {label}Weekly Data Export – {now}",
+                                 xlsx, _team_filename(team))
+        result = _deliver_outbox(ids)
+        if ids and not result["sent"]:
+            raise RuntimeError("; ".join(f["error"] for f in result["failed"]) or "No recipients delivered.")
         with engine.begin() as conn:
-            conn.exec_driver_sql("DELETE FROM events")
-        print("[weekly] Sent and cleared successfully.")
+            _clear_events(conn)
+        print(
+            f"[weekly] {len(workbooks)} workbook(s); sent to {len(result['sent'])}, "
+            f"failed {len(result['failed'])}; cleared."
+        )
+        _inc("gch_scheduler_jobs_total", (("job", "weekly_rollup"), ("outcome", "ok")))
     except Exception as e:
-        print(f"[weekly] ERROR: {e}")
-scheduler = BackgroundScheduler(timezone=TZ)
-scheduler.add_job(weekly_rollup_job, "cron", day_of_week="fri", hour=17, minute=00)
-scheduler.start()
\ No newline at end of file
+        _inc("gch_scheduler_jobs_total", (("job", "weekly_rollup"), ("outcome", "error")))
+        print(f"[weekly] ERROR: {e}")
\ No newline at end of file
@@ -0,0 +1,163 @@
+# server/seed.py
+import argparse
+import random
+import string
+import sys
+import time
+from datetime import datetime, timedelta
+import pytz
+from server.main import (
+    EVENT_COLUMNS, _bump_daily_gen, _clear_events, _daily_rollup, _shard_index, _upsert_daily, shard_engines,
+)
+ALLOWED_TEAMS = ["Aortic", "CAS", "CRDN", "ECT", "PVH", "SVT", "TCT", "CPT", "DS", "PCS & CDS", "PM", "MCS"]
+TEAM_WEIGHTS = [6, 9, 12, 5, 7, 8, 6, 4, 3, 5, 10, 4]
+SECTIONS = [
+    "Reportability", "Regulatory Report", "Regulatory Inquiry", "Product Analysis",
+    "Investigation", "Communication", "Task", "E-mail",
+]
+SECTION_WEIGHTS = [18, 8, 4, 12, 20, 14, 16, 8]
+WEEKDAY_WEIGHTS = [22, 22, 21, 20, 13, 1, 1]
+HOUR_WEIGHTS = {7: 4, 8: 10, 9: 14, 10: 15, 11: 12, 12: 7, 13: 11, 14: 12, 15: 9, 16: 5, 17: 2}
+HEARTBEAT_MS = 60 * 1000
+CHICAGO = pytz.timezone("America/Chicago")
+def _complaint_id(rng: random.Random) -> str:
+    return rng.choice("67") + "".join(rng.choice(string.digits) for _ in range(rng.randint(5, 11)))
+def _session_id(rng: random.Random) -> str:
+    return "".join(rng.choice(string.ascii_lowercase + string.digits) for _ in range(11))
+def _fmt_ts(t: datetime) -> str:
+    return t.strftime("%Y-%m-%dT%H:%M:%S.") + f"{t.microsecond // 1000:03d}Z"
+def generate_events(n: int, users: int = 300, days: int = 28, seed: int = 1):
+    rng = random.Random(seed)
+    today = datetime.now(CHICAGO).date()
+    day_pool = [today - timedelta(days=d) for d in range(days)]
+    day_weights = [WEEKDAY_WEIGHTS[d.weekday()] for d in day_pool]
+    hours, hour_weights = list(HOUR_WEIGHTS), list(HOUR_WEIGHTS.values())
+    people = [
+        (f"user{i:05d}@medtronic.com", rng.choices(ALLOWED_TEAMS, TEAM_WEIGHTS)[0])
+        for i in range(users)
+    ]
+    backlog = {team: [_complaint_id(rng) for _ in range(max(20, users // 4))] for team in ALLOWED_TEAMS}
+    produced = 0
+    while produced < n:
+        email, team = rng.choice(people)
+        complaint_id = rng.choice(backlog[team])
+        source = "CW" if rng.random() < 0.15 else "GCH"
+        section = "Complaint Wizard" if source == "CW" else rng.choices(SECTIONS, SECTION_WEIGHTS)[0]
+        session_id = _session_id(rng)
+        page = (
+            "https://mspm7aapps0377.cfrf.medtronic.com/intake/index.html"
+            if source == "CW" else
+            f"https://crm.medtronic.com/sap/bc/bsp/sap/crm_ui_start/default.htm?OBJECT_ID={complaint_id}"
+        )
+        day = rng.choices(day_pool, day_weights)[0]
+        local = datetime(day.year, day.month, day.day, rng.choices(hours, hour_weights)[0],
+                         rng.randrange(60), rng.randrange(60), rng.randrange(1000) * 1000)
+        t = CHICAGO.localize(local).astimezone(pytz.utc)
+        beats = min(int(rng.expovariate(1 / 12)) + 1, 240, n - produced - 1)
+        rows = [(_fmt_ts(t), email, team, complaint_id, source, section, "open", 0, 0, page, session_id)]
+        for _ in range(beats):
+            t += timedelta(milliseconds=HEARTBEAT_MS + rng.randrange(-500, 500))
+            active = rng.randrange(HEARTBEAT_MS) if rng.random() < 0.25 else HEARTBEAT_MS - rng.randrange(2000)
+            idle = rng.randrange(HEARTBEAT_MS - active + 1) if active < HEARTBEAT_MS - 2000 else 0
+            reason = "heartbeat"
+            if source == "GCH" and rng.random() < 0.08:
+                reason = "section_change"
+            rows.append((_fmt_ts(t), email, team, complaint_id, source, section, reason, active, idle, page, session_id))
+            if reason == "section_change":
+                section = rng.choices(SECTIONS, SECTION_WEIGHTS)[0]
+        if produced + len(rows) < n:
+            t += timedelta(milliseconds=rng.randrange(1000, HEARTBEAT_MS))
+            rows.append((_fmt_ts(t), email, team, complaint_id, source, section, "unload",
+                         rng.randrange(30000), 0, page, session_id))
+        produced += len(rows)
+        yield from rows
+def _batches(rows, size: int):
+    batch = []
+    for r in rows:
+        batch.append(r)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+def _rollup(batch) -> dict:
+    return _daily_rollup((r[0], r[2], r[1], r[3], r[4], r[5], r[7], r[8]) for r in batch)
+def load_postgres(eng, rows, batch_size: int, progress=None) -> int:
+    total = 0
+    with eng.connect() as conn:
+        raw = conn.connection.driver_connection
+        for batch in _batches(rows, batch_size):
+            cur = raw.cursor()
+            cur.execute("SELECT pg_current_xact_id()")
+            with cur.copy(f"COPY events ({', '.join(EVENT_COLUMNS)}) FROM STDIN") as cp:
+                for r in batch:
+                    cp.write_row(r)
+            _upsert_daily(conn, _rollup(batch))
+            _bump_daily_gen(conn)
+            conn.commit()
+            total += len(batch)
+            if progress:
+                progress(total)
+    return total
+def load_sqlite(eng, rows, batch_size: int, progress=None) -> int:
+    total = 0
+    sql = f"INSERT INTO events ({', '.join(EVENT_COLUMNS)}) VALUES ({', '.join('?' * len(EVENT_COLUMNS))})"
+    with eng.connect() as conn:
+        conn.exec_driver_sql("PRAGMA synchronous=OFF")
+        for batch in _batches(rows, batch_size):
+            conn.exec_driver_sql(sql, batch)
+            _upsert_daily(conn, _rollup(batch))
+            conn.commit()
+            _bump_daily_gen()
+            total += len(batch)
+            if progress:
+                progress(total)
+        conn.exec_driver_sql("PRAGMA synchronous=NORMAL")
+    return total
+def seed(rows: int, users: int = 300, days: int = 28, seed: int = 1, batch_size: int = 50000,
+         truncate: bool = False, quiet: bool = False, eng=None) -> int:
+    engines = [eng] if eng is not None else shard_engines
+    eng = engines[0]
+    if truncate:
+        with eng.begin() as conn:
+            _clear_events(conn)
+    t0 = time.perf_counter()
+    def progress(done: int) -> None:
+        if not quiet:
+            rate = done / max(time.perf_counter() - t0, 1e-9)
+            print(f"[seed] {done:,}/{rows:,} rows ({rate:,.0f} rows/s)", flush=True)
+    gen = generate_events(rows, users=users, days=days, seed=seed)
+    if eng.url.get_backend_name().startswith("postgresql"):
+        total = load_postgres(eng, gen, batch_size, progress)
+    elif len(engines) == 1:
+        total = load_sqlite(eng, gen, batch_size, progress)
+    else:
+        total = 0
+        for batch in _batches(gen, batch_size):
+            by_shard: dict[int, list] = {}
+            for r in batch:
+                by_shard.setdefault(_shard_index(r[10], r[0]), []).append(r)
+            for i, part in by_shard.items():
+                total += load_sqlite(engines[i], part, batch_size)
+            progress(total)
+    if not quiet:
+        print(f"[seed] loaded {total:,} rows in {time.perf_counter() - t0:.1f}s into {eng.url.render_as_string()}"
+              + (f" (+{len(engines) - 1} shards)" if len(engines) > 1 else ""))
+    return total
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(
+        description="Bulk-load synthetic events into the database configured by DATABASE_URL / DB_PATH."
+    )
+    ap.add_argument("--rows", type=int, required=True, help="number of events to generate")
+    ap.add_argument("--users", type=int, default=300, help="distinct simulated analysts")
+    ap.add_argument("--days", type=int, default=28, help="spread events over this many days back from today")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--batch", type=int, default=50000, help="rows per COPY / transaction")
+    ap.add_argument("--truncate", action="store_true", help="delete existing events first")
+    ap.add_argument("--quiet", action="store_true")
+    args = ap.parse_args(argv)
+    seed(args.rows, users=args.users, days=args.days, seed=args.seed,
+         batch_size=args.batch, truncate=args.truncate, quiet=args.quiet)
+    return 0
+if __name__ == "__main__":
+    sys.exit(main())
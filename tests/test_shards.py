@@ -0,0 +1,67 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+REPO_ROOT = Path(__file__).resolve().parents[1]
+SNAPSHOT = r"""
+import io, json
+import pandas as pd
+from fastapi.testclient import TestClient
+import server.main as m
+from server.seed import seed
+seed(6000, users=30, days=14, seed=7, batch_size=1000, quiet=True)
+def rows(resp):
+    return sorted(json.dumps(r, sort_keys=True) for r in resp.json())
+with TestClient(m.app) as cl:
+    out = {
+        "shards": m.SHARD_COUNT,
+        "per_shard": [e.connect().exec_driver_sql("SELECT COUNT(*) FROM events").scalar() for e in m.shard_engines],
+        "sessions": rows(cl.get("/sessions")),
+        "sessions_by_section": rows(cl.get("/sessions_by_section")),
+        "sections_by_weekday": rows(cl.get("/sections_by_weekday")),
+    }
+    cursor, pulled = "", []
+    while True:
+        page = cl.get("/events_since", params={"since": cursor, "limit": 1500}).json()
+        pulled += page["rows"]
+        cursor = page["cursor"]
+        if not page["more"]:
+            break
+    out["events_since_unique_seq"] = len({r["seq"] for r in pulled}) == len(pulled)
+    out["events_since"] = sorted(json.dumps({k: v for k, v in r.items() if k != "seq"}, sort_keys=True) for r in pulled)
+    sheets = pd.read_excel(io.BytesIO(cl.get("/export.xlsx").content), sheet_name=None)
+    out["export"] = {
+        name: [len(df), {c: round(float(df[c].sum()), 3) for c in df.select_dtypes("number").columns}]
+        for name, df in sheets.items()
+    }
+print(json.dumps(out))
+"""
+def _snapshot(tmp_path: Path, shards: int, shard_by: str) -> dict:
+    env = {
+        **os.environ,
+        "DATABASE_URL": "",
+        "DATABASE_READ_URL": "",
+        "DB_PATH": str(tmp_path / "events.db"),
+        "DB_SHARDS": str(shards),
+        "DB_SHARD_BY": shard_by,
+        "SUBSCRIBERS_CSV_PATH": str(tmp_path / "subscribers.csv"),
+        "METRICS_TOKEN": "",
+    }
+    proc = subprocess.run([sys.executable, "-c", SNAPSHOT], cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr[-4000:]
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+@pytest.fixture(scope="module")
+def single(tmp_path_factory) -> dict:
+    return _snapshot(tmp_path_factory.mktemp("single"), 1, "session")
+@pytest.mark.parametrize("shards,shard_by", [(3, "session"), (3, "day"), (4, "session")])
+def test_sharded_totals_match_single_file(single, tmp_path, shards, shard_by):
+    sharded = _snapshot(tmp_path, shards, shard_by)
+    assert single["shards"] == 1
+    assert sharded["shards"] == shards
+    assert all(sharded["per_shard"])
+    assert sum(sharded["per_shard"]) == sum(single["per_shard"])
+    assert sharded["events_since_unique_seq"]
+    for key in ("sessions", "sessions_by_section", "sections_by_weekday", "events_since", "export"):
+        assert sharded[key] == single[key], key